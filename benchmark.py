@@ -0,0 +1,429 @@
+# -*- encoding: utf-8 -*-
+"""
+    Sequence benchmark
+
+    Measure the throughput and the latency of the allocation of sequence
+    numbers for the incremental and postgres sequences, by id and by code,
+    in a single transaction or in a transaction per number, with threads or
+    processes.
+
+    Usage::
+
+        python benchmark.py --cluster --output results.json
+        python benchmark.py --cluster --baseline results.json
+
+    :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Ltd..
+    :license: GPLv3, see LICENSE for more details.
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from optparse import OptionParser
+
+TYPES = ['incremental', 'postgres_seq']
+LOOKUPS = ['id', 'code']
+MODES = ['single', 'separate']
+WORKERS = ['thread', 'process']
+CONCURRENCY = [1, 2, 4, 8, 16, 32, 64]
+PERCENTILES = [50, 95, 99]
+
+# Connection pools inherited by the forked workers. They are kept referenced
+# so that their connections, shared with the parent, are never closed
+_INHERITED_POOLS = []
+
+
+def percentile(values, rank):
+    """Return the nearest-rank percentile of the values
+
+    :param values: Sorted list of values
+    :param rank: Percentile between 0 and 100
+    """
+    if not values:
+        return None
+    index = max(int(round(rank / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(latencies, seconds, errors=0):
+    """Return the summary of a run
+
+    :param latencies: List of the latencies in seconds of each allocation
+    :param seconds: Wall time of the run
+    :param errors: Count of the allocations retried after a serialization
+        failure
+    :return: A dictionary with the count, the throughput per second and the
+        percentiles in milliseconds
+    """
+    latencies = sorted(latencies)
+    summary = {
+        'count': len(latencies),
+        'errors': errors,
+        'seconds': seconds,
+        'throughput': len(latencies) / seconds if seconds else None,
+        }
+    for rank in PERCENTILES:
+        value = percentile(latencies, rank)
+        summary['p%s' % rank] = value * 1000 if value is not None else None
+    return summary
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return the regressions of the results against the baseline. A
+    scenario regresses when its throughput drops or its p99 latency rises by
+    more than the tolerance.
+
+    :param results: Result dictionary of run
+    :param baseline: Result dictionary of a previous run
+    :param tolerance: Allowed relative variation
+    :return: List of (scenario name, metric, baseline value, value)
+    """
+    regressions = []
+    previous = dict((scenario['name'], scenario)
+        for scenario in baseline['scenarios'])
+    for scenario in results['scenarios']:
+        reference = previous.get(scenario['name'])
+        if reference is None:
+            continue
+        if (reference['throughput'] and scenario['throughput']
+                < reference['throughput'] * (1 - tolerance)):
+            regressions.append((scenario['name'], 'throughput',
+                reference['throughput'], scenario['throughput']))
+        if (reference['p99'] and scenario['p99']
+                > reference['p99'] * (1 + tolerance)):
+            regressions.append((scenario['name'], 'p99', reference['p99'],
+                scenario['p99']))
+    return regressions
+
+
+class TemporaryCluster(object):
+    """A throwaway PostgreSQL cluster created with initdb in a temporary
+    directory and listening only on a unix socket. The trytond configuration
+    points to it while the context is active."""
+
+    def __init__(self, bindir=None, port=None):
+        """
+        :param bindir: Directory of initdb and pg_ctl, found in PATH if None
+        :param port: Port of the socket, a free one if None
+        """
+        self.bindir = bindir
+        self.port = port
+        self.directory = None
+        self.user = 'tryton'
+
+    def _command(self, name):
+        if self.bindir:
+            return os.path.join(self.bindir, name)
+        return name
+
+    def _free_port(self):
+        sock = socket.socket()
+        try:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+        finally:
+            sock.close()
+
+    def __enter__(self):
+        from trytond.config import CONFIG
+        self.directory = tempfile.mkdtemp(prefix='sequence_benchmark')
+        data = os.path.join(self.directory, 'data')
+        if self.port is None:
+            self.port = self._free_port()
+        subprocess.check_call([self._command('initdb'), '-D', data,
+                '-A', 'trust', '-U', self.user, '-E', 'UTF8'],
+            stdout=open(os.devnull, 'w'))
+        subprocess.check_call([self._command('pg_ctl'), '-D', data,
+                '-l', os.path.join(self.directory, 'postgresql.log'),
+                '-o', "-p %s -k %s -c listen_addresses='' "
+                    "-c max_connections=300" % (self.port, self.directory),
+                '-w', 'start'],
+            stdout=open(os.devnull, 'w'))
+        self.config = dict((key, CONFIG[key]) for key in ('db_type',
+                'db_host', 'db_port', 'db_user', 'db_password', 'data_path'))
+        CONFIG['db_type'] = 'postgresql'
+        CONFIG['db_host'] = self.directory
+        CONFIG['db_port'] = self.port
+        CONFIG['db_user'] = self.user
+        CONFIG['db_password'] = False
+        CONFIG['data_path'] = os.path.join(self.directory, 'filestore')
+        return self
+
+    def __exit__(self, type, value, traceback):
+        from trytond.config import CONFIG
+        for key, value in self.config.iteritems():
+            CONFIG[key] = value
+        subprocess.call([self._command('pg_ctl'), '-D',
+                os.path.join(self.directory, 'data'), '-m', 'fast', '-w',
+                'stop'], stdout=open(os.devnull, 'w'))
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def setup_database(database_name):
+    """Create the database if missing and install the module
+
+    :param database_name: Name of the database
+    """
+    from trytond.config import CONFIG
+    from trytond.backend import Database
+    from trytond.modules import register_classes
+    from trytond.pool import Pool
+    from trytond.protocols.dispatcher import create
+    from trytond.transaction import Transaction
+
+    register_classes()
+    if not CONFIG['admin_passwd']:
+        CONFIG['admin_passwd'] = 'admin'
+    database = Database().connect()
+    cursor = database.cursor()
+    databases = database.list(cursor)
+    cursor.close()
+    if database_name not in databases:
+        create(database_name, CONFIG['admin_passwd'], 'en_US', 'admin')
+    pool = Pool(database_name)
+    pool.init()
+    with Transaction().start(database_name, 0) as transaction:
+        module_obj = pool.get('ir.module.module')
+        module_ids = module_obj.search([
+            ('name', '=', 'sequence_postgres'),
+            ('state', '!=', 'installed'),
+            ])
+        if not module_ids:
+            return
+        module_obj.button_install(module_ids)
+        transaction.cursor.commit()
+
+        install_upgrade_obj = pool.get('ir.module.module.install_upgrade',
+            type='wizard')
+        wiz_id = install_upgrade_obj.create()
+        transaction.cursor.commit()
+        install_upgrade_obj.execute(wiz_id, {}, 'start')
+        transaction.cursor.commit()
+        install_upgrade_obj.delete(wiz_id)
+        transaction.cursor.commit()
+
+
+def create_sequence(database_name, name, type_):
+    """Create a sequence and its type for a scenario
+
+    :return: The id and the code of the sequence
+    """
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    pool = Pool(database_name)
+    code = 'benchmark.%s.%s' % (name, int(time.time() * 1000))
+    with Transaction().start(database_name, 0) as transaction:
+        pool.get('ir.sequence.type').create({
+            'name': name,
+            'code': code,
+            })
+        sequence_id = pool.get('ir.sequence').create({
+            'name': name,
+            'code': code,
+            'type': type_,
+            })
+        transaction.cursor.commit()
+    return sequence_id, code
+
+
+def allocate(database_name, sequence, lookup, mode, repeat, queue):
+    """Allocate `repeat` numbers and push the latencies and the count of
+    retries into the queue. An allocation failing on a serialization error
+    is retried after a rollback, as a client would do.
+
+    :param database_name: Name of the database
+    :param sequence: Id or code of the sequence
+    :param lookup: 'id' to use get_id or 'code' to use get
+    :param mode: 'single' for a single transaction or 'separate' for a
+        transaction per number
+    :param repeat: Count of numbers to allocate
+    :param queue: Queue receiving the tuple (latencies, errors)
+    """
+    from psycopg2 import OperationalError
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    sequence_obj = Pool(database_name).get('ir.sequence')
+    get = sequence_obj.get_id if lookup == 'id' else sequence_obj.get
+    latencies, errors = [], 0
+    if mode == 'single':
+        with Transaction().start(database_name, 0) as transaction:
+            for _ in xrange(repeat):
+                start = time.time()
+                while True:
+                    try:
+                        get(sequence)
+                        break
+                    except OperationalError:
+                        transaction.cursor.rollback()
+                        errors += 1
+                latencies.append(time.time() - start)
+            transaction.cursor.commit()
+    else:
+        for _ in xrange(repeat):
+            start = time.time()
+            while True:
+                with Transaction().start(database_name, 0) as transaction:
+                    try:
+                        get(sequence)
+                        transaction.cursor.commit()
+                        break
+                    except OperationalError:
+                        transaction.cursor.rollback()
+                        errors += 1
+            latencies.append(time.time() - start)
+    queue.put((latencies, errors))
+
+
+def _allocate_process(database_name, *args):
+    """Run allocate in a forked process with its own connections"""
+    from trytond.backend import Database
+    database = Database(database_name)
+    _INHERITED_POOLS.append(database._connpool)
+    database._connpool = None
+    allocate(database_name, *args)
+
+
+def run_scenario(database_name, scenario, repeat):
+    """Run a scenario and return its summary
+
+    :param database_name: Name of the database
+    :param scenario: Dictionary with type, lookup, mode, workers and
+        concurrency
+    :param repeat: Count of numbers allocated by each worker
+    """
+    sequence_id, code = create_sequence(database_name, scenario['name'],
+        scenario['type'])
+    sequence = sequence_id if scenario['lookup'] == 'id' else code
+    args = (database_name, sequence, scenario['lookup'], scenario['mode'],
+        repeat)
+    queue = multiprocessing.Queue()
+    if scenario['workers'] == 'thread':
+        workers = [threading.Thread(target=allocate, args=args + (queue,))
+            for _ in xrange(scenario['concurrency'])]
+    else:
+        workers = [multiprocessing.Process(target=_allocate_process,
+                args=args + (queue,))
+            for _ in xrange(scenario['concurrency'])]
+    start = time.time()
+    [worker.start() for worker in workers]
+    results = [queue.get() for _ in workers]
+    [worker.join() for worker in workers]
+    seconds = time.time() - start
+    latencies = sum((latencies for latencies, _ in results), [])
+    errors = sum(errors for _, errors in results)
+    summary = scenario.copy()
+    summary.update(summarize(latencies, seconds, errors))
+    return summary
+
+
+def scenarios(types=TYPES, lookups=LOOKUPS, modes=MODES, workers=WORKERS,
+        concurrency=CONCURRENCY):
+    "Return the scenarios of the cartesian product of the parameters"
+    for type_ in types:
+        for lookup in lookups:
+            for mode in modes:
+                for worker in workers:
+                    for count in concurrency:
+                        yield {
+                            'name': '%s-%s-%s-%s-%s' % (type_, lookup, mode,
+                                worker, count),
+                            'type': type_,
+                            'lookup': lookup,
+                            'mode': mode,
+                            'workers': worker,
+                            'concurrency': count,
+                            }
+
+
+def run(database_name, repeat=200, **parameters):
+    """Run the scenarios and return the results
+
+    :param database_name: Name of the database
+    :param repeat: Count of numbers allocated by each worker
+    :param parameters: Parameters of scenarios
+    """
+    setup_database(database_name)
+    results = {
+        'repeat': repeat,
+        'python': sys.version.split()[0],
+        'scenarios': [],
+        }
+    for scenario in scenarios(**parameters):
+        summary = run_scenario(database_name, scenario, repeat)
+        results['scenarios'].append(summary)
+        sys.stderr.write('%(name)s: %(throughput).0f/s p50 %(p50).2fms '
+            'p95 %(p95).2fms p99 %(p99).2fms\n' % summary)
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-c', '--config', dest='config',
+        help='trytond configuration file')
+    parser.add_option('--database', dest='database',
+        default='sequence_benchmark', help='name of the database')
+    parser.add_option('--cluster', dest='cluster', action='store_true',
+        help='run against a temporary PostgreSQL cluster')
+    parser.add_option('--bindir', dest='bindir',
+        help='directory of initdb and pg_ctl')
+    parser.add_option('--repeat', dest='repeat', type='int', default=200,
+        help='numbers allocated by each worker')
+    parser.add_option('--types', dest='types', default=','.join(TYPES))
+    parser.add_option('--lookups', dest='lookups', default=','.join(LOOKUPS))
+    parser.add_option('--modes', dest='modes', default=','.join(MODES))
+    parser.add_option('--workers', dest='workers', default=','.join(WORKERS))
+    parser.add_option('--concurrency', dest='concurrency',
+        default=','.join(map(str, CONCURRENCY)))
+    parser.add_option('--output', dest='output',
+        help='file to write the JSON results to')
+    parser.add_option('--baseline', dest='baseline',
+        help='JSON results to compare with')
+    parser.add_option('--tolerance', dest='tolerance', type='float',
+        default=0.2, help='allowed relative variation from the baseline')
+    options, _ = parser.parse_args(argv)
+
+    if options.config:
+        from trytond.config import CONFIG
+        CONFIG.configfile = options.config
+        CONFIG.load()
+
+    parameters = {
+        'types': options.types.split(','),
+        'lookups': options.lookups.split(','),
+        'modes': options.modes.split(','),
+        'workers': options.workers.split(','),
+        'concurrency': [int(x) for x in options.concurrency.split(',')],
+        }
+    if options.cluster:
+        with TemporaryCluster(options.bindir):
+            results = run(options.database, options.repeat, **parameters)
+    else:
+        results = run(options.database, options.repeat, **parameters)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as result_file:
+            result_file.write(output)
+    else:
+        print output
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file),
+                options.tolerance)
+        for name, metric, reference, value in regressions:
+            sys.stderr.write('REGRESSION %s %s: %.2f -> %.2f\n'
+                % (name, metric, reference, value))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+# -*- encoding: utf-8 -*-
+"""
+    Native sequence emulation
+
+    The postgres sequences emulated with a table for the backends without
+    sequences, so that the postgres_seq type can be used and tested on
+    SQLite.
+
+    :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Ltd..
+    :license: GPLv3, see LICENSE for more details.
+"""
+from trytond.backend import TableHandler
+from trytond.config import CONFIG
+
+# Bounds of the postgres sequences without MINVALUE or MAXVALUE
+MIN_BIGINT = -(1 << 63)
+MAX_BIGINT = (1 << 63) - 1
+
+
+def placeholders(values):
+    "Return the placeholders of the values for an IN clause"
+    return ', '.join(['%s'] * len(values))
+
+
+class SequenceError(Exception):
+    """Error of an emulated sequence, raised where postgres raises a
+    database error"""
+
+
+class TableSequences(object):
+    """Postgres sequences emulated by the rows of the ir_sequence_native
+    table, one per postgres sequence name.
+
+    A row is allocated from with an UPDATE followed by a SELECT: the UPDATE
+    takes the write lock of the database, so no other transaction can
+    allocate from the table until the end of the transaction. Unlike a
+    postgres sequence, the numbers are therefore given back on rollback.
+
+    The options are given as dictionaries with the increment, min_value,
+    max_value and cycle keys, a min_value or max_value of 0 or None stands
+    for the default bound.
+    """
+
+    def init(self, cursor):
+        "Create the table of the emulated sequences"
+        if not TableHandler.table_exist(cursor, 'ir_sequence_native'):
+            cursor.execute("CREATE TABLE ir_sequence_native ("
+                    "name VARCHAR PRIMARY KEY, "
+                    "sequence INTEGER NOT NULL, "
+                    "number_next INTEGER NOT NULL, "
+                    "increment INTEGER NOT NULL, "
+                    "min_value INTEGER NOT NULL, "
+                    "max_value INTEGER NOT NULL, "
+                    "cycle BOOLEAN NOT NULL"
+                ")")
+            cursor.execute("CREATE INDEX ir_sequence_native_sequence "
+                "ON ir_sequence_native (sequence)")
+
+    def _bounds(self, options):
+        "Return the minimum and maximum values of the options"
+        if options['increment'] > 0:
+            default_min, default_max = 1, MAX_BIGINT
+        else:
+            default_min, default_max = MIN_BIGINT, -1
+        return (options['min_value'] or default_min,
+            options['max_value'] or default_max)
+
+    def create(self, cursor, sequences, if_not_exists=False):
+        """Create the emulated sequences
+
+        :param sequences: List of tuples (sequence id, name, start, options)
+        :param if_not_exists: If True the existing names are left untouched
+        """
+        for id, name, start, options in sequences:
+            min_value, max_value = self._bounds(options)
+            cursor.execute("INSERT " + ('OR IGNORE ' if if_not_exists else '')
+                + "INTO ir_sequence_native (name, sequence, number_next, "
+                    "increment, min_value, max_value, cycle) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (name, id, start, options['increment'], min_value, max_value,
+                    bool(options['cycle'])))
+
+    def alter(self, cursor, sequences):
+        """Change the options of the emulated sequences
+
+        :param sequences: List of tuples (name, restart, options) where
+            restart is the next number or None to keep it
+        """
+        for name, restart, options in sequences:
+            min_value, max_value = self._bounds(options)
+            query = ("UPDATE ir_sequence_native SET increment = %s, "
+                "min_value = %s, max_value = %s, cycle = %s")
+            params = [options['increment'], min_value, max_value,
+                bool(options['cycle'])]
+            if restart is not None:
+                query += ", number_next = %s"
+                params.append(restart)
+            cursor.execute(query + " WHERE name = %s", params + [name])
+
+    def drop(self, cursor, ids):
+        """Drop the emulated sequences of the ir.sequence with their
+        periods"""
+        if ids:
+            cursor.execute("DELETE FROM ir_sequence_native "
+                "WHERE sequence IN (" + placeholders(ids) + ")", list(ids))
+
+    def names(self, cursor, ids):
+        """Return the names of the emulated sequences of the ir.sequence
+
+        :return: A list of tuples (sequence id, name)
+        """
+        if not ids:
+            return []
+        cursor.execute("SELECT sequence, name FROM ir_sequence_native "
+            "WHERE sequence IN (" + placeholders(ids) + ")", list(ids))
+        return cursor.fetchall()
+
+    def nextvals(self, cursor, name, count):
+        """Allocate `count` values of the emulated sequence, wrapping around
+        its bounds when it cycles
+
+        :return: List of the values
+        """
+        cursor.execute("UPDATE ir_sequence_native "
+            "SET number_next = number_next WHERE name = %s", (name,))
+        cursor.execute("SELECT number_next, increment, min_value, max_value, "
+                "cycle "
+            "FROM ir_sequence_native WHERE name = %s", (name,))
+        row = cursor.fetchone()
+        if row is None:
+            raise SequenceError('Sequence "%s" does not exist' % name)
+        number, increment, min_value, max_value, cycle = row
+        values = []
+        for _ in xrange(count):
+            if not min_value <= number <= max_value:
+                if not cycle:
+                    raise SequenceError(
+                        'Sequence "%s" reached its bound' % name)
+                number = min_value if increment > 0 else max_value
+            values.append(number)
+            number += increment
+        cursor.execute("UPDATE ir_sequence_native SET number_next = %s "
+            "WHERE name = %s", (number, name))
+        return values
+
+    def next_numbers(self, cursor, ids):
+        """Return the next number of the emulated sequences of the
+        ir.sequence, without their periods
+
+        :return: A dictionary with the ids as keys
+        """
+        if not ids:
+            return {}
+        cursor.execute("SELECT sequence, number_next "
+            "FROM ir_sequence_native "
+            "WHERE name = 'ir_sequence_' || sequence "
+                "AND sequence IN (" + placeholders(ids) + ")", list(ids))
+        return dict(cursor.fetchall())
+
+    def setval(self, cursor, ids, value):
+        "Set the next number of the emulated sequences of the ir.sequence"
+        if ids:
+            cursor.execute("UPDATE ir_sequence_native SET number_next = %s "
+                "WHERE name = 'ir_sequence_' || sequence "
+                    "AND sequence IN (" + placeholders(ids) + ")",
+                [value] + list(ids))
+
+
+EMULATIONS = {
+    'sqlite': TableSequences(),
+    }
+
+
+def emulation():
+    """Return the emulation of the postgres sequences of the configured
+    backend or None when it has native sequences"""
+    return EMULATIONS.get(CONFIG['db_type'])
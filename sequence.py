@@ -4,108 +4,2098 @@
     :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Ltd..
     :license: GPLv3, see LICENSE for more details.
 """
+import os
+import re
+import gzip
+import json
+import time
+import datetime
+import weakref
+import threading
+from collections import namedtuple
+
 from trytond.model import ModelView, ModelSQL, fields
+from trytond.backend import TableHandler, Database
+from trytond.cache import Cache
+from trytond.pyson import Eval, Not, Equal
 from trytond.transaction import Transaction
 from trytond.config import CONFIG
+from snowflake import Snowflake, MAX_NODE
+from shared_pool import SharedPool
+from native import emulation, MAX_BIGINT
+import stats
+
+STATES = {
+    'invisible': Not(Equal(Eval('type'), 'postgres_seq')),
+}
+DEPENDS = ['type']
+
+# Fields of ir.sequence which define the options of the postgres sequence
+OPTION_FIELDS = ['number_increment', 'block_size', 'stripes', 'cache_size',
+    'min_value', 'max_value', 'cycle', 'unlogged']
+
+# Fields of ir.sequence which require to ALTER the postgres sequence
+ALTER_FIELDS = set(['number_next'] + OPTION_FIELDS)
+
+# Next value of a postgres sequence from its row of pg_sequences. The
+# last_value of pg_sequences is NULL once the sequence is restarted or set
+# without being called, so it is read from the relation itself.
+NATIVE_NEXT = ("ir_sequence_native_next(pg_sequences.sequencename, "
+    "pg_sequences.increment_by)")
+
+# Names of the postgres sequences: ir_sequence_<id> for the first stripe and
+# ir_sequence_<id>_<stripe> for the others. The pattern is valid for python
+# and postgres regular expressions.
+NATIVE_NAME_PATTERN = '^ir_sequence_([0-9]+)(?:_([0-9]+))?$'
+NATIVE_NAME_RE = re.compile(NATIVE_NAME_PATTERN)
+
+# Names of the postgres sequences of the periods of a sequence with a reset
+# period: ir_sequence_<id>_p<year> or ir_sequence_<id>_p<year><month>
+PERIOD_NAME_PATTERN = '^ir_sequence_([0-9]+)_p([0-9]+)$'
+PERIOD_NAME_RE = re.compile(PERIOD_NAME_PATTERN)
+PERIOD_FORMATS = {
+    'year': '%Y',
+    'month': '%Y%m',
+    }
+
+
+def native_name(id, stripe=0):
+    """Return the name of the postgres sequence of a stripe of the
+    ir.sequence"""
+    if stripe:
+        return 'ir_sequence_%d_%d' % (id, stripe)
+    return 'ir_sequence_%d' % id
+
+
+def native_names_query(condition='TRUE'):
+    """Return a query of the id, stripe and name of the postgres sequences of
+    the postgres_seq records matching the condition on ir_sequence"""
+    return ("SELECT id AS sequence, stripe, 'ir_sequence_' || id "
+            "|| CASE WHEN stripe = 0 THEN '' ELSE '_' || stripe END AS name "
+        "FROM (SELECT id, generate_series(0, stripes - 1) AS stripe "
+            "FROM ir_sequence "
+            "WHERE type = 'postgres_seq' AND " + condition + ") AS stripes")
+
+
+def native_next_query(condition='TRUE'):
+    """Return a query of the id and next number, the highest of its stripes,
+    of the postgres_seq records matching the condition on ir_sequence"""
+    return ("SELECT native.sequence, max(" + NATIVE_NEXT + ") AS number_next "
+        "FROM (" + native_names_query(condition) + ") AS native "
+            "JOIN pg_sequences "
+                "ON pg_sequences.schemaname = current_schema() "
+                    "AND pg_sequences.sequencename = native.name "
+        "GROUP BY native.sequence")
+
+# Seconds for which the samples of ir_sequence_history are kept
+HISTORY_RETENTION = 6 * 60 * 60
+
+# Bounds in seconds of the duration and of the interval of profile_contention,
+# which holds a connection while it samples
+PROFILE_MAX_DURATION = 60
+PROFILE_MIN_INTERVAL = 0.01
+
+# Version of the files written by export_state
+STATE_VERSION = 2
+
+# Types of sequences allocated by this module
+NATIVE_TYPES = ('postgres_seq', 'postgres_gapless', 'postgres_snowflake')
+
+# What is needed to allocate and format a number of a native sequence, cached
+# per code and per id so that get and get_id skip the ORM
+SequenceDescriptor = namedtuple('SequenceDescriptor', ['id', 'type',
+    'padding', 'prefix', 'suffix', 'number_increment', 'block_size',
+    'stripes', 'shared_pool', 'oids', 'reset_period'])
+
+# Functions returning the next formatted value of the native sequences in a
+# single SQL call, for the ORM as well as for triggers and bulk loaders. The
+# prefix and suffix get the same substitutions as in Sequence._process.
+FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION ir_sequence_native_state(sequence_name VARCHAR,
+    OUT last_value BIGINT, OUT is_called BOOLEAN)
+AS $func$
+BEGIN
+    EXECUTE format('SELECT last_value, is_called FROM %I', sequence_name)
+        INTO last_value, is_called;
+END;
+$func$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION ir_sequence_native_next(sequence_name VARCHAR,
+    increment BIGINT)
+RETURNS BIGINT AS $func$
+DECLARE
+    last BIGINT;
+    called BOOLEAN;
+BEGIN
+    EXECUTE format('SELECT last_value, is_called FROM %I', sequence_name)
+        INTO last, called;
+    IF called THEN
+        RETURN last + increment;
+    END IF;
+    RETURN last;
+END;
+$func$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION ir_sequence_process(template_string VARCHAR)
+RETURNS VARCHAR AS $func$
+    SELECT replace(replace(replace(replace(replace(replace(replace(
+        replace(COALESCE($1, ''), '$$', E'\\001'),
+        '${year}', to_char(current_date, 'YYYY')),
+        '$year', to_char(current_date, 'YYYY')),
+        '${month}', to_char(current_date, 'MM')),
+        '$month', to_char(current_date, 'MM')),
+        '${day}', to_char(current_date, 'DD')),
+        '$day', to_char(current_date, 'DD')),
+        E'\\001', '$')
+$func$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION ir_sequence_format(sequence_id INTEGER,
+    number BIGINT)
+RETURNS VARCHAR AS $func$
+DECLARE
+    seq RECORD;
+    value VARCHAR;
+BEGIN
+    SELECT prefix, suffix, padding INTO seq
+        FROM ir_sequence WHERE id = sequence_id;
+    value := number::VARCHAR;
+    IF length(value) < seq.padding THEN
+        value := lpad(value, seq.padding, '0');
+    END IF;
+    RETURN ir_sequence_process(seq.prefix) || value
+        || ir_sequence_process(seq.suffix);
+END;
+$func$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION ir_sequence_next(sequence_id INTEGER)
+RETURNS VARCHAR AS $func$
+DECLARE
+    seq RECORD;
+    stripe INTEGER;
+    number BIGINT;
+BEGIN
+    SELECT type, block_size, stripes, reset_period, number_increment
+        INTO seq
+        FROM ir_sequence WHERE id = sequence_id;
+    IF seq.type = 'postgres_seq' AND seq.block_size = 1
+            AND COALESCE(seq.reset_period, '') = '' THEN
+        stripe := pg_backend_pid() % seq.stripes;
+        IF stripe > 0 THEN
+            number := nextval(('ir_sequence_' || sequence_id || '_'
+                    || stripe)::regclass);
+        ELSE
+            number := nextval(('ir_sequence_' || sequence_id)::regclass);
+        END IF;
+    ELSIF seq.type = 'postgres_gapless' THEN
+        UPDATE ir_sequence_counter
+            SET number_next = number_next + seq.number_increment
+            WHERE ir_sequence_counter.sequence = sequence_id
+            RETURNING number_next - seq.number_increment INTO number;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Sequence % has no counter', sequence_id;
+        END IF;
+    ELSE
+        RAISE EXCEPTION 'Sequence % can not be allocated from SQL',
+            sequence_id;
+    END IF;
+    RETURN ir_sequence_format(sequence_id, number);
+END;
+$func$ LANGUAGE plpgsql VOLATILE;
+
+CREATE OR REPLACE FUNCTION ir_sequence_numbers(sequence_id INTEGER,
+    quantity INTEGER)
+RETURNS SETOF BIGINT AS $func$
+DECLARE
+    seq RECORD;
+    stripe INTEGER;
+    number BIGINT;
+BEGIN
+    SELECT type, block_size, stripes, reset_period, number_increment
+        INTO seq
+        FROM ir_sequence WHERE id = sequence_id;
+    IF seq.type = 'postgres_seq' AND seq.block_size = 1
+            AND COALESCE(seq.reset_period, '') = '' THEN
+        stripe := pg_backend_pid() % seq.stripes;
+        RETURN QUERY SELECT nextval(('ir_sequence_' || sequence_id
+                || CASE WHEN stripe > 0 THEN '_' || stripe ELSE '' END
+                )::regclass)
+            FROM generate_series(1, quantity);
+        RETURN;
+    ELSIF seq.type = 'postgres_gapless' THEN
+        UPDATE ir_sequence_counter
+            SET number_next = number_next + seq.number_increment * quantity
+            WHERE ir_sequence_counter.sequence = sequence_id
+            RETURNING number_next - seq.number_increment * quantity
+                INTO number;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Sequence % has no counter', sequence_id;
+        END IF;
+    ELSIF seq.type = 'incremental' THEN
+        UPDATE ir_sequence
+            SET number_next = number_next + seq.number_increment * quantity
+            WHERE ir_sequence.id = sequence_id
+            RETURNING number_next - seq.number_increment * quantity
+                INTO number;
+    ELSE
+        RAISE EXCEPTION 'Sequence % can not be allocated from SQL',
+            sequence_id;
+    END IF;
+    RETURN QUERY SELECT number + seq.number_increment * i
+        FROM generate_series(0, quantity - 1) AS i;
+END;
+$func$ LANGUAGE plpgsql VOLATILE;
+
+CREATE OR REPLACE FUNCTION ir_sequence_resolve_deferred()
+RETURNS TRIGGER AS $func$
+DECLARE
+    target RECORD;
+    pending RECORD;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM ir_sequence_deferred
+            WHERE transaction = txid_current()) THEN
+        -- Already resolved by the trigger of another request
+        RETURN NULL;
+    END IF;
+    -- Forget the requests of the records deleted since
+    FOR target IN SELECT DISTINCT target_table FROM ir_sequence_deferred
+            WHERE transaction = txid_current() LOOP
+        EXECUTE format('DELETE FROM ir_sequence_deferred AS deferred '
+            'WHERE deferred.transaction = txid_current() '
+                'AND deferred.target_table = %L '
+                'AND NOT EXISTS (SELECT 1 FROM %I '
+                    'WHERE %I.id = deferred.record)',
+            target.target_table, target.target_table, target.target_table);
+    END LOOP;
+    -- Allocate the numbers of each sequence in bulk, in request order
+    FOR pending IN SELECT sequence, count(*)::INTEGER AS quantity
+            FROM ir_sequence_deferred
+            WHERE transaction = txid_current()
+            GROUP BY sequence LOOP
+        UPDATE ir_sequence_deferred
+            SET value = ir_sequence_format(pending.sequence, allocated.number)
+            FROM (SELECT id, row_number() OVER (ORDER BY id) AS rank
+                    FROM ir_sequence_deferred
+                    WHERE transaction = txid_current()
+                        AND sequence = pending.sequence) AS ranked
+                JOIN ir_sequence_numbers(pending.sequence, pending.quantity)
+                        WITH ORDINALITY AS allocated(number, rank)
+                    ON allocated.rank = ranked.rank
+            WHERE ir_sequence_deferred.id = ranked.id;
+    END LOOP;
+    -- Write the numbers with an UPDATE per target field
+    FOR target IN SELECT DISTINCT target_table, target_field
+            FROM ir_sequence_deferred
+            WHERE transaction = txid_current() LOOP
+        EXECUTE format('UPDATE %I SET %I = deferred.value '
+            'FROM ir_sequence_deferred AS deferred '
+            'WHERE deferred.transaction = txid_current() '
+                'AND deferred.target_table = %L '
+                'AND deferred.target_field = %L '
+                'AND %I.id = deferred.record',
+            target.target_table, target.target_field, target.target_table,
+            target.target_field, target.target_table);
+    END LOOP;
+    DELETE FROM ir_sequence_deferred WHERE transaction = txid_current();
+    RETURN NULL;
+END;
+$func$ LANGUAGE plpgsql VOLATILE;
+
+CREATE OR REPLACE FUNCTION ir_sequence_next_code(sequence_code VARCHAR)
+RETURNS VARCHAR AS $func$
+    SELECT ir_sequence_next(id) FROM (
+        SELECT id FROM ir_sequence
+            WHERE code = $1 AND active
+            ORDER BY id LIMIT 1) AS s
+$func$ LANGUAGE sql VOLATILE;
+"""
+
+# Placeholder of a number assigned at commit
+DEFERRED_TOKEN = '#%d'
+
+# Id of the sequence in the text of a query updating a row of ir_sequence or
+# of ir_sequence_counter
+WAIT_QUERY_RE = re.compile(r'\bir_sequence(?:_counter)?"?\s.*?'
+    r'\b"?(?:id|sequence)"?\s*(?:=|IN\s*\()\s*(\d+)',
+    re.IGNORECASE | re.DOTALL)
+
+
+def attribute_wait(relation, sequence_id, query):
+    """Return the id of the sequence a lock wait is attributed to, None if it
+    can not be attributed and False if it is not on a sequence
+
+    :param relation: Name of the relation of the awaited lock or None
+    :param sequence_id: Id of the ir_sequence row whose tuple lock is held or
+        awaited by the waiting process, or None
+    :param query: Text of the query of the waiting process
+    """
+    if sequence_id:
+        return sequence_id
+    if relation:
+        match = (NATIVE_NAME_RE.match(relation)
+            or PERIOD_NAME_RE.match(relation))
+        if match:
+            return int(match.group(1))
+    match = WAIT_QUERY_RE.search(query or '')
+    if match:
+        return int(match.group(1))
+    if relation in ('ir_sequence', 'ir_sequence_counter') \
+            or 'ir_sequence' in (query or ''):
+        return None
+    return False
+
+
+# Statements prepared once per database connection. The postgres sequences
+# are given by OID so that neither the statements nor their plans depend on a
+# relation. They return no row instead of failing when the OID is not the one
+# of an existing relation.
+PREPARE_SQL = """
+PREPARE ir_sequence_nextval(regclass) AS
+    SELECT nextval($1)
+    WHERE EXISTS (SELECT 1 FROM pg_class WHERE oid = $1);
+PREPARE ir_sequence_nextvals(regclass, integer) AS
+    SELECT nextval($1) FROM generate_series(1, $2)
+    WHERE EXISTS (SELECT 1 FROM pg_class WHERE oid = $1);
+"""
+
+# The connections on which PREPARE_SQL was executed
+_PREPARED = weakref.WeakKeyDictionary()
+
+# Blocks of numbers reserved by this process for the postgres sequences with
+# a block size, keyed by (pid, database name, sequence id). The value is the
+# next number to hand out and the count of numbers left in the block.
+_BLOCKS = {}
+_BLOCKS_LOCK = threading.Lock()
+
+# Locks serialising the allocations from the block of each key of _BLOCKS,
+# held across the refill of the block. They are created under _BLOCKS_LOCK.
+_BLOCK_LOCKS = {}
+
+# Snowflake generators of this process keyed by (pid, database name), with
+# the cursor holding the lease of their node id. The node id of a generator is
+# leased once with a session advisory lock held until the process exits.
+_SNOWFLAKES = {}
+_SNOWFLAKES_LOCK = threading.Lock()
+
+# Shared pools opened by this process keyed by (pid, database name, sequence
+# id), guarded by _BLOCKS_LOCK
+_SHARED_POOLS = {}
 
 
 class Sequence(ModelSQL, ModelView):
     "Postgres Sequence"
     _name = 'ir.sequence'
+
+    block_size = fields.Integer('Block Size', required=True,
+        states=STATES, depends=DEPENDS,
+        help='Count of numbers reserved by each server process per call '
+            'to the database. A block size above 1 leaves gaps in the '
+            'sequence.')
+    cache_size = fields.Integer('Cache Size', required=True,
+        states=STATES, depends=DEPENDS,
+        help='Count of numbers preallocated by each database connection. '
+            'A cache size above 1 leaves gaps in the sequence.')
+    min_value = fields.Integer('Minimum Value', states=STATES,
+        depends=DEPENDS, help='Leave 0 for the default minimum value.')
+    max_value = fields.Integer('Maximum Value', states=STATES,
+        depends=DEPENDS, help='Leave 0 for the default maximum value.')
+    cycle = fields.Boolean('Cycle', states=STATES, depends=DEPENDS,
+        help='Restart from the minimum value once the maximum value is '
+            'reached.')
+    stripes = fields.Integer('Stripes', required=True, states=STATES,
+        depends=DEPENDS,
+        help='Count of postgres sequences sharing the allocation to reduce '
+            'the contention between the server processes. The numbers are '
+            'only roughly increasing with more than 1 stripe.')
+    reset_period = fields.Selection([
+            ('', 'None'),
+            ('year', 'Yearly'),
+            ('month', 'Monthly'),
+            ], 'Reset Period', states=STATES, depends=DEPENDS,
+        help='Restart the numbering for each period of the date of the '
+            'context or of today. The numbers of a period are allocated one '
+            'at a time from their own postgres sequence, without block.')
+    shared_pool = fields.Boolean('Shared Pool', states=STATES,
+        depends=DEPENDS,
+        help='Share the block between the server processes of the host so '
+            'that a block is refilled only once exhausted by all of them.')
+    unlogged = fields.Boolean('Unlogged', states=STATES, depends=DEPENDS,
+        help='Do not write the sequence to the write-ahead log. An unlogged '
+            'sequence is reset after a crash. Requires PostgreSQL 15.')
+    number_next_live = fields.Function(fields.Integer('Next Number (Live)',
+        help='The next number of the postgres sequence or of the gap-free '
+            'counter.'), 'get_number_next_live', setter='set_number_next_live')
     
     def __init__(self):
-        if CONFIG.options['db_type'] == 'postgresql':
+        if CONFIG.options['db_type'] == 'postgresql' \
+                or emulation() is not None:
             postgresql_type = ('postgres_seq', 'Postgres Native Sequence')
             if postgresql_type not in self.type.selection:
                 self.type.selection.append(postgresql_type)
+        if CONFIG.options['db_type'] == 'postgresql':
+            gapless_type = ('postgres_gapless', 'Postgres Gap-free Counter')
+            if gapless_type not in self.type.selection:
+                self.type.selection.append(gapless_type)
+            snowflake_type = ('postgres_snowflake', 'Snowflake Time-Ordered Id')
+            if snowflake_type not in self.type.selection:
+                self.type.selection.append(snowflake_type)
         super(Sequence, self).__init__()
+        self._sql_constraints += [
+            ('check_block_size', 'CHECK(block_size > 0)',
+                'Block size must be greater than 0!'),
+            ('check_cache_size', 'CHECK(cache_size > 0)',
+                'Cache size must be greater than 0!'),
+            ('check_stripes', 'CHECK(stripes > 0)',
+                'Stripes must be greater than 0!'),
+        ]
+        self._constraints += [
+            ('check_emulated_block', 'emulated_block'),
+        ]
+        self._error_messages.update({
+            'deferred_type': 'Sequence "%s" can not assign numbers at '
+                'commit!',
+            'deferred_field': 'Field "%s" of "%s" can not receive a number!',
+            'deferred_access': 'You can not write field "%s" of these '
+                '"%s" records!',
+            'emulated_block': 'The postgres sequences of this database '
+                'can not have a block size or a shared pool!',
+            'state_version': 'Version "%s" of the sequence state is not '
+                'supported!',
+            'missing_counter': 'Gap-free sequence "%s" has no counter!',
+            'emulated_unsupported': 'This operation requires the postgres '
+                'sequences of PostgreSQL!',
+            'snowflake_node': 'The %s node ids of the snowflake '
+                'sequences are all in use!',
+            })
+        self._rpc.update({
+            'reconcile_sequences': True,
+            'migrate_to_native': True,
+            'profile_contention': False,
+            'purge_periods': True,
+            'get_deferred': True,
+            'cancel_deferred': True,
+            'get_statistics': False,
+            'reset_statistics': True,
+            'enable_statistics': True,
+            'sample_sequences': True,
+            'forecast_exhaustion': True,
+        })
+
+    def init(self, module_name):
+        cursor = Transaction().cursor
+        # Migration from 2.0.0.1: the options are missing
+        table = TableHandler(cursor, self, module_name)
+        migrate_options = not table.column_exist('cache_size')
+
+        super(Sequence, self).init(module_name)
+
+        # The backends without sequences only get the emulation of the
+        # postgres sequences
+        if emulation() is not None:
+            emulation().init(cursor)
+            return
+
+        # The counters of the gap-free sequences are kept out of ir_sequence
+        # so that allocating a number locks a narrow row which is updated
+        # without going through the ORM. The low fillfactor leaves room for
+        # HOT updates of the counters.
+        if not TableHandler.table_exist(cursor, 'ir_sequence_counter'):
+            cursor.execute("CREATE TABLE ir_sequence_counter ("
+                    "sequence INTEGER PRIMARY KEY "
+                        "REFERENCES ir_sequence ON DELETE CASCADE, "
+                    "number_next INTEGER NOT NULL"
+                ") WITH (fillfactor = 50)")
+
+        # The requests of numbers assigned at commit. A request is resolved
+        # by a trigger deferred to the commit of its transaction.
+        if not TableHandler.table_exist(cursor, 'ir_sequence_deferred'):
+            cursor.execute("CREATE TABLE ir_sequence_deferred ("
+                    "id SERIAL PRIMARY KEY, "
+                    "transaction BIGINT NOT NULL DEFAULT txid_current(), "
+                    "sequence INTEGER NOT NULL "
+                        "REFERENCES ir_sequence ON DELETE CASCADE, "
+                    "target_table VARCHAR NOT NULL, "
+                    "target_field VARCHAR NOT NULL, "
+                    "record INTEGER NOT NULL, "
+                    "value VARCHAR"
+                ")")
+            cursor.execute("CREATE INDEX ir_sequence_deferred_transaction "
+                "ON ir_sequence_deferred (transaction)")
+
+        # The samples of the next numbers of the postgres sequences from which
+        # their allocation rate is computed
+        if not TableHandler.table_exist(cursor, 'ir_sequence_history'):
+            cursor.execute("CREATE TABLE ir_sequence_history ("
+                    "sequence INTEGER NOT NULL "
+                        "REFERENCES ir_sequence ON DELETE CASCADE, "
+                    "sampled TIMESTAMP NOT NULL, "
+                    "number_next BIGINT NOT NULL"
+                ")")
+            cursor.execute("CREATE INDEX ir_sequence_history_sequence "
+                "ON ir_sequence_history (sequence, sampled)")
+            cursor.execute("CREATE INDEX ir_sequence_history_sampled "
+                "ON ir_sequence_history (sampled)")
+
+        cursor.execute(FUNCTIONS_SQL)
+        cursor.execute("DROP TRIGGER IF EXISTS ir_sequence_deferred_resolve "
+            "ON ir_sequence_deferred")
+        cursor.execute("CREATE CONSTRAINT TRIGGER "
+                "ir_sequence_deferred_resolve "
+            "AFTER INSERT ON ir_sequence_deferred "
+            "DEFERRABLE INITIALLY DEFERRED "
+            "FOR EACH ROW EXECUTE PROCEDURE ir_sequence_resolve_deferred()")
+
+        # The first node id tried by the snowflake generator of a server
+        # process, the node ids are leased with advisory locks
+        cursor.execute("CREATE SEQUENCE IF NOT EXISTS "
+                "ir_sequence_snowflake_node "
+            "MINVALUE 0 MAXVALUE %s START WITH 0 CYCLE", (MAX_NODE,))
+
+        # Migration from 2.0.0.1: apply the options to the existing postgres
+        # sequences
+        if migrate_options:
+            self._migrate_options()
+
+    def _migrate_options(self):
+        "Apply the options of the ir.sequence to their postgres sequences"
+        cursor = Transaction().cursor
+        cursor.execute("SELECT id, " + ', '.join(OPTION_FIELDS) + " "
+            "FROM ir_sequence "
+            "WHERE type = 'postgres_seq' "
+                "AND EXISTS (SELECT 1 FROM pg_class "
+                    "WHERE relkind = 'S' "
+                        "AND relname = 'ir_sequence_' || ir_sequence.id)")
+        sequences = cursor.dictfetchall()
+        if sequences:
+            native_stripes = self._native_stripes(
+                [sequence['id'] for sequence in sequences])
+            queries, params = self._persistence_queries(sequences)
+            for sequence in sequences:
+                options, options_params = self._sequence_options(sequence)
+                for stripe in native_stripes.get(sequence['id'], {}):
+                    queries.append("ALTER SEQUENCE "
+                        + native_name(sequence['id'], stripe) + " " + options)
+                    params += options_params
+            self._execute_batch(queries, params)
+
+    def check_emulated_block(self, ids):
+        """Check that the emulated postgres sequences have neither a block
+        size nor a shared pool. The emulated numbers are given back on
+        rollback while a block reserved by the process is kept, so its
+        numbers would be handed out again."""
+        if emulation() is None:
+            return True
+        for sequence in self.browse(ids):
+            if sequence.type == 'postgres_seq' and (sequence.block_size > 1
+                    or sequence.shared_pool):
+                return False
+        return True
+
+    def default_block_size(self):
+        return 1
+
+    def default_cache_size(self):
+        return 1
+
+    def default_stripes(self):
+        return 1
+
+    def default_reset_period(self):
+        return ''
+
+    def get_number_next_live(self, ids, name):
+        """Return the next number of the sequences with a single query. It
+        comes from pg_sequences for the postgres sequences, from the counter
+        for the gap-free sequences and from number_next otherwise."""
+        cursor = Transaction().cursor
+        if emulation() is not None:
+            numbers = emulation().next_numbers(cursor, ids)
+            return dict((sequence['id'],
+                    numbers.get(sequence['id'], sequence['number_next']))
+                for sequence in self.read(ids, ['number_next']))
+        cursor.execute("SELECT ir_sequence.id, COALESCE(native.number_next, "
+                "ir_sequence_counter.number_next, ir_sequence.number_next) "
+            "FROM ir_sequence "
+                "LEFT JOIN (" + native_next_query('id = ANY(%s)') + ") "
+                    "AS native ON native.sequence = ir_sequence.id "
+                "LEFT JOIN ir_sequence_counter "
+                    "ON ir_sequence.type = 'postgres_gapless' "
+                        "AND ir_sequence_counter.sequence = ir_sequence.id "
+            "WHERE ir_sequence.id = ANY(%s)", (list(ids), list(ids)))
+        return dict(cursor.fetchall())
+
+    def set_number_next_live(self, ids, name, value):
+        """Set the next number of the sequences: setval for the postgres
+        sequences, the counter for the gap-free sequences and number_next for
+        all of them."""
+        if value is None:
+            return
+        cursor = Transaction().cursor
+        if emulation() is not None:
+            emulation().setval(cursor, ids, value)
+            cursor.execute("UPDATE ir_sequence SET number_next = %s "
+                "WHERE id IN (" + ', '.join(['%s'] * len(ids)) + ")",
+                [value] + list(ids))
+            self._reset_blocks(ids)
+            return
+        cursor.execute("SELECT setval(native.name::regclass, "
+                "%s + native.stripe * ir_sequence.number_increment "
+                    "* ir_sequence.block_size, false) "
+            "FROM (" + native_names_query('id = ANY(%s)') + ") AS native "
+                "JOIN ir_sequence ON ir_sequence.id = native.sequence",
+            (value, list(ids)))
+        cursor.execute("UPDATE ir_sequence_counter SET number_next = %s "
+            "WHERE sequence = ANY(%s)", (value, list(ids)))
+        cursor.execute("UPDATE ir_sequence SET number_next = %s "
+            "WHERE id = ANY(%s)", (value, list(ids)))
+        self._reset_blocks(ids)
         
     def create(self, values):
         """Create the postgres sequence after creation of ir.sequence if the
         type is postrges"""
         id = super(Sequence, self).create(values)
+        self._sequence_descriptor.reset()
         if values.get('type') == 'postgres_seq':
-            self.create_sequence(id)
+            self.create_sequence([id])
+        elif values.get('type') == 'postgres_gapless':
+            self.create_counter([id])
         return id
 
     def write(self, ids, values):
-        """Write to the postgres sequence after the editing
+        """Write to the postgres sequences after the editing. The ids are
+        classified with a single read and the postgres sequences and counters
+        are changed in batch.
         """
         ids = [ids] if isinstance(ids, (long, int)) else ids
+        types_before_write = dict((sequence['id'], sequence['type'])
+            for sequence in self.read(ids, ['type']))
+        alter = bool(ALTER_FIELDS.intersection(values))
+
+        to_create, to_alter, to_drop = [], [], []
+        counters_to_create, counters_to_alter, counters_to_drop = [], [], []
         for id in ids:
-            type_before_write = self.browse(id).type
-            rv = super(Sequence, self).write(id, values)
-            if type_before_write != 'postgres_seq':
-                if values.get('type') != 'postgres_seq':
-                    return rv
-                self.create_sequence(id)
-                return rv
-            else:
-                if values.get('type') != 'postgres_seq':
-                    self.drop_sequence(id)
-                    return rv
-                self.alter_sequence(id)
+            type_before_write = types_before_write[id]
+            type_after_write = values.get('type', type_before_write)
+            if type_before_write == 'postgres_seq':
+                if type_after_write != 'postgres_seq':
+                    to_drop.append(id)
+                elif alter:
+                    to_alter.append(id)
+            elif type_after_write == 'postgres_seq':
+                to_create.append(id)
+            if type_before_write == 'postgres_gapless':
+                if type_after_write != 'postgres_gapless':
+                    counters_to_drop.append(id)
+                elif 'number_next' in values:
+                    counters_to_alter.append(id)
+            elif type_after_write == 'postgres_gapless':
+                counters_to_create.append(id)
+
+        if counters_to_drop:
+            # Give the counters back before number_next is written
+            self.drop_counter(counters_to_drop)
+        rv = super(Sequence, self).write(ids, values)
+        if to_drop:
+            self.drop_sequence(to_drop)
+        if to_create:
+            self.create_sequence(to_create)
+        if to_alter:
+            self.alter_sequence(to_alter, restart='number_next' in values)
+        if counters_to_create:
+            self.create_counter(counters_to_create)
+        if counters_to_alter:
+            self.alter_counter(counters_to_alter)
+        if 'reset_period' in values:
+            self._native_period.reset()
+        self._sequence_descriptor.reset()
         return rv
 
     def delete(self, ids):
-        """Delete the sequence if there is one in postgres"""
-        # TODO: DROP the sequence if it exists
-        return super(Sequence, self).delete(ids)
+        """Delete the sequences and DROP their postgres sequences. The
+        counters of the gap-free sequences are deleted in cascade."""
+        ids = [ids] if isinstance(ids, (long, int)) else ids
+        native_ids = [sequence['id'] for sequence in self.read(ids, ['type'])
+            if sequence['type'] == 'postgres_seq']
+        rv = super(Sequence, self).delete(ids)
+        if native_ids:
+            self.drop_sequence(native_ids)
+        self._sequence_descriptor.reset()
+        return rv
 
-    def create_sequence(self, id):
-        """CREATE the sequence in database
+    def _execute_batch(self, queries, params):
+        """Execute the queries in a single call to the database
 
-        :param id: Id of the ir.sequence for which a postgres sequence is to 
-            be created
-        :type id: int, long
+        :param queries: List of SQL statements
+        :param params: List of the parameters of all the statements
         """
-        # The name of the sequence in the database
-        sequence = self.browse(id)
-        
-        with Transaction().new_cursor() as transaction:
-            transaction.cursor.execute("""CREATE SEQUENCE ir_sequence_%s 
-                INCREMENT BY %s START WITH %s""", (id, 
-                    sequence.number_increment, sequence.number_next,))
-            transaction.cursor.commit()
+        if queries:
+            Transaction().cursor.execute(';\n'.join(queries), params)
 
+    @stats.timed('create_sequence')
+    def create_sequence(self, ids):
+        """CREATE the sequences in database, one per stripe. The statements
+        are issued in batch within the current transaction.
+
+        :param ids: Ids of the ir.sequence for which a postgres sequence is
+            to be created
+        :type ids: list, int, long
+        """
+        ids = [ids] if isinstance(ids, (long, int)) else ids
+        if emulation() is not None:
+            emulation().create(Transaction().cursor, [
+                    (sequence['id'], native_name(sequence['id']),
+                        sequence['number_next'],
+                        self._emulated_options(sequence))
+                    for sequence in self.read(ids,
+                        ['number_next'] + OPTION_FIELDS)])
+            self._reset_blocks(ids)
+            self._sequence_descriptor.reset()
+            return True
+        queries, params = [], []
+        for sequence in self.read(ids, ['number_next'] + OPTION_FIELDS):
+            options, options_params = self._sequence_options(sequence)
+            for stripe in xrange(sequence['stripes']):
+                queries.append(self._create_query(sequence, stripe, options))
+                params += options_params + [self._stripe_start(sequence,
+                        sequence['number_next'], stripe)]
+        self._execute_batch(queries, params)
+        self._reset_blocks(ids)
+        self._sequence_descriptor.reset()
         return True
 
-    def alter_sequence(self, id):
-        """ALTER the current sequence"""
-        sequence = self.browse(id)
-        
+    @stats.timed('alter_sequence')
+    def alter_sequence(self, ids, restart=True):
+        """ALTER the sequences in database. The statements are issued in batch
+        within the current transaction.
+
+        A striped sequence, or one whose stripes do not match the ir.sequence,
+        is laid out again from its next number so that the values of the
+        stripes stay disjoint: the extra stripes are dropped, the missing ones
+        created and the others restarted.
+
+        :param ids: Ids of the ir.sequence
+        :param restart: If True the postgres sequences restart with the next
+            number of the ir.sequence, otherwise from their highest next value
+        """
+        ids = [ids] if isinstance(ids, (long, int)) else ids
+        sequences = self.read(ids, ['number_next'] + OPTION_FIELDS)
+        if emulation() is not None:
+            self._alter_emulated(sequences, restart)
+            self._reset_blocks(ids)
+            self._sequence_descriptor.reset()
+            return True
+        native_stripes = self._native_stripes(ids)
+        increments = {}
+        if not restart:
+            cursor = Transaction().cursor
+            cursor.execute("SELECT sequencename, increment_by "
+                "FROM pg_sequences "
+                "WHERE schemaname = current_schema() "
+                    "AND sequencename = ANY(%s)",
+                ([native_name(id) for id in ids],))
+            increments = dict(cursor.fetchall())
+        queries, params = self._persistence_queries(sequences)
+        for sequence in sequences:
+            id = sequence['id']
+            options, options_params = self._sequence_options(sequence)
+            existing = native_stripes.get(id, {})
+            if sequence['stripes'] == 1 and existing.keys() == [0]:
+                name = native_name(id)
+                query = "ALTER SEQUENCE " + name + " " + options
+                params += options_params
+                if restart:
+                    query += " RESTART WITH %s"
+                    params.append(sequence['number_next'])
+                queries.append(query)
+                if not restart:
+                    # The last value may be the first number of a block
+                    # handed out with the former increment. The sequence is
+                    # set past that block once the ALTER holds the lock which
+                    # excludes the concurrent nextval.
+                    queries.append("SELECT setval(%s, CASE "
+                            "WHEN state.is_called "
+                                "THEN state.last_value + %s "
+                            "ELSE state.last_value END, false) "
+                        "FROM ir_sequence_native_state(%s) AS state")
+                    params += [name, increments[name], name]
+                continue
+            if restart or not existing:
+                number_next = sequence['number_next']
+            else:
+                number_next = max(existing.values())
+            for stripe in existing:
+                if stripe >= sequence['stripes']:
+                    queries.append("DROP SEQUENCE " + native_name(id, stripe))
+            for stripe in xrange(sequence['stripes']):
+                if stripe in existing:
+                    queries.append("ALTER SEQUENCE " + native_name(id, stripe)
+                        + " " + options + " RESTART WITH %s")
+                else:
+                    queries.append(self._create_query(sequence, stripe,
+                            options))
+                params += options_params + [self._stripe_start(sequence,
+                        number_next, stripe)]
+        sequences = dict((sequence['id'], sequence) for sequence in sequences)
+        for id, _, name in self._period_names(ids):
+            options, options_params = self._period_options(sequences[id])
+            queries.append("ALTER SEQUENCE " + name + " " + options)
+            params += options_params
+        self._execute_batch(queries, params)
+        self._reset_blocks(ids)
+        self._sequence_descriptor.reset()
+        return True
+
+    @stats.timed('drop_sequence')
+    def drop_sequence(self, ids):
+        """DROP the sequences in database, with all their stripes and
+        periods, with a single statement within the current transaction"""
+        ids = [ids] if isinstance(ids, (long, int)) else ids
+        if emulation() is not None:
+            emulation().drop(Transaction().cursor, ids)
+            self._reset_blocks(ids)
+            self._native_period.reset()
+            self._sequence_descriptor.reset()
+            return True
+        names = [native_name(id, stripe)
+            for id, stripes in self._native_stripes(ids).iteritems()
+            for stripe in stripes]
+        names += [name for _, _, name in self._period_names(ids)]
+        if names:
+            Transaction().cursor.execute("DROP SEQUENCE IF EXISTS "
+                + ', '.join(names))
+        self._reset_blocks(ids)
+        self._native_period.reset()
+        self._sequence_descriptor.reset()
+        return True
+
+    def _emulated_options(self, sequence, period=False):
+        """Return the options of the emulated sequence of a backend without
+        sequences. It has a single stripe and the cache size and the
+        persistence do not apply.
+
+        :param sequence: Dictionary with the OPTION_FIELDS values of the
+            ir.sequence
+        :param period: If True the options of the sequence of a period, which
+            hands out numbers one at a time
+        """
+        return {
+            'increment': sequence['number_increment']
+                * (1 if period else sequence['block_size']),
+            'min_value': sequence['min_value'],
+            'max_value': sequence['max_value'],
+            'cycle': sequence['cycle'],
+            }
+
+    def _alter_emulated(self, sequences, restart):
+        """Apply the options of the ir.sequence to their emulated sequences
+        and to those of their periods
+
+        :param sequences: List of dictionaries with the number_next and
+            OPTION_FIELDS values of the ir.sequence
+        :param restart: If True the emulated sequences restart with the next
+            number of the ir.sequence
+        """
+        cursor = Transaction().cursor
+        sequences = dict((sequence['id'], sequence) for sequence in sequences)
+        rows = []
+        for id, name in emulation().names(cursor, sequences.keys()):
+            sequence = sequences[id]
+            if name == native_name(id):
+                rows.append((name,
+                        sequence['number_next'] if restart else None,
+                        self._emulated_options(sequence)))
+            else:
+                rows.append((name, None,
+                        self._emulated_options(sequence, period=True)))
+        emulation().alter(cursor, rows)
+
+    def _create_query(self, sequence, stripe, options):
+        """Return the statement creating the postgres sequence of a stripe,
+        its parameters are the options parameters and the start value
+
+        :param sequence: Dictionary with the OPTION_FIELDS values of the
+            ir.sequence
+        :param stripe: Index of the stripe
+        :param options: Options clause from _sequence_options
+        """
+        return ("CREATE " + ('UNLOGGED ' if sequence['unlogged'] else '')
+            + "SEQUENCE " + native_name(sequence['id'], stripe) + " "
+            + options + " START WITH %s")
+
+    def _stripe_start(self, sequence, number_next, stripe):
+        """Return the first value of a stripe when the sequence is laid out
+        from number_next. Each stripe starts one block after the previous one
+        and they all increment by stripes blocks."""
+        return number_next \
+            + stripe * sequence['number_increment'] * sequence['block_size']
+
+    def _native_stripes(self, ids):
+        """Return the stripes of the postgres sequences existing in database
+        with a single query
+
+        :param ids: Ids of the ir.sequence
+        :return: A dictionary with the ids as keys and as values dictionaries
+            of the next value of the postgres sequence of each stripe
+        """
+        cursor = Transaction().cursor
+        cursor.execute("SELECT sequencename, " + NATIVE_NEXT + " "
+            "FROM pg_sequences "
+            "WHERE schemaname = current_schema() "
+                "AND substring(sequencename from %s)::integer = ANY(%s)",
+            (NATIVE_NAME_PATTERN, list(ids)))
+        native_stripes = {}
+        for name, number_next in cursor.fetchall():
+            id, stripe = NATIVE_NAME_RE.match(name).groups()
+            native_stripes.setdefault(int(id), {})[int(stripe or 0)] = \
+                number_next
+        return native_stripes
+
+    def _period_names(self, ids):
+        """Return the postgres sequences of the periods of the sequences
+        existing in database with a single query
+
+        :param ids: Ids of the ir.sequence
+        :return: A list of tuples (id, period key, name)
+        """
+        cursor = Transaction().cursor
+        cursor.execute("SELECT relname FROM pg_class "
+            "WHERE relkind = 'S' "
+                "AND pg_table_is_visible(pg_class.oid) "
+                "AND substring(relname from %s)::integer = ANY(%s)",
+            (PERIOD_NAME_PATTERN, list(ids)))
+        names = []
+        for name, in cursor.fetchall():
+            id, key = PERIOD_NAME_RE.match(name).groups()
+            names.append((int(id), key, name))
+        return names
+
+    def _period_options(self, sequence):
+        """Return the options of the postgres sequences of the periods. They
+        are not striped and hand out numbers one at a time."""
+        sequence = sequence.copy()
+        sequence['block_size'] = 1
+        sequence['stripes'] = 1
+        return self._sequence_options(sequence)
+
+    def _period_key(self, sequence):
+        "Return the key of the period of the date of the context or today"
+        date = Transaction().context.get('date') or datetime.date.today()
+        return date.strftime(PERIOD_FORMATS[sequence.reset_period])
+
+    def _period_sequence(self, sequence):
+        """Return the name of the postgres sequence of the current period of
+        the sequence. It is created on first use by _native_period.
+
+        :param sequence: BrowseRecord or SequenceDescriptor of the sequence
+        """
+        key = self._period_key(sequence)
+        if emulation() is None:
+            return self._native_period(sequence.id, key)
+        # Created within the current transaction, the write lock of the
+        # backend already excludes the concurrent creations. The name is not
+        # cached as a rollback drops it.
+        name = 'ir_sequence_%d_p%s' % (sequence.id, key)
+        with Transaction().set_user(0):
+            values = self.read(sequence.id, OPTION_FIELDS)
+        emulation().create(Transaction().cursor, [(sequence.id, name,
+                    values['min_value'] or 1,
+                    self._emulated_options(values, period=True))],
+            if_not_exists=True)
+        return name
+
+    @Cache('ir_sequence.sequence_descriptor')
+    def _native_period(self, id, key):
+        """Create the postgres sequence of a period of the sequence in a
+        separate transaction, unless it exists, and return its name. So only
+        the first allocation of a period by a process queries the database.
+        The cache shares its name with the cache of _sequence_descriptor, so
+        it is cleared in all the processes when the postgres sequences are
+        altered or dropped by one of them.
+
+        :param id: Id of the sequence
+        :param key: Key of the period
+        :return: The name of the postgres sequence
+        """
+        from psycopg2 import IntegrityError, ProgrammingError
+        name = 'ir_sequence_%d_p%s' % (id, key)
+        with Transaction().set_user(0):
+            values = self.read(id, OPTION_FIELDS)
+        options, params = self._period_options(values)
         with Transaction().new_cursor() as transaction:
-            transaction.cursor.execute("""ALTER SEQUENCE ir_sequence_%s 
-            INCREMENT BY %s RESTART WITH %s""", (id, sequence.number_increment, 
-                sequence.number_next))
-            transaction.cursor.commit()
+            cursor = transaction.cursor
+            try:
+                cursor.execute("CREATE "
+                    + ('UNLOGGED ' if values['unlogged'] else '')
+                    + "SEQUENCE IF NOT EXISTS " + name + " " + options
+                    + " START WITH %s",
+                    params + [values['min_value'] or 1])
+                cursor.commit()
+            except (IntegrityError, ProgrammingError):
+                # Created by a concurrent transaction
+                cursor.rollback()
+        return name
+
+    def _check_native(self):
+        """Raise a user error when the postgres sequences are emulated, for
+        the calls which work on the postgres sequences themselves"""
+        if emulation() is not None:
+            self.raise_user_error('emulated_unsupported')
+
+    def purge_periods(self, keep=1):
+        """DROP the postgres sequences of the periods older than the current
+        period and the `keep` previous ones, and those of the sequences
+        without reset period or with another one. This is a maintenance call
+        to run once the old periods are closed.
+
+        :param keep: Count of previous periods to keep
+        :return: The list of the names of the postgres sequences dropped
+        """
+        self._check_native()
+        self.pool.get('ir.model.access').check(self._name, 'write')
+        cursor = Transaction().cursor
+        cursor.execute("SELECT relname, ir_sequence.reset_period "
+            "FROM pg_class "
+                "LEFT JOIN ir_sequence "
+                    "ON ir_sequence.type = 'postgres_seq' "
+                        "AND ir_sequence.id = "
+                            "substring(relname from %s)::integer "
+            "WHERE relkind = 'S' "
+                "AND pg_table_is_visible(pg_class.oid) "
+                "AND relname ~ %s",
+            (PERIOD_NAME_PATTERN, PERIOD_NAME_PATTERN))
+        date = Transaction().context.get('date') or datetime.date.today()
+        months = date.year * 12 + date.month - 1 - keep
+        oldest = {
+            'year': '%04d' % (date.year - keep),
+            'month': '%04d%02d' % (months // 12, months % 12 + 1),
+            }
+        names, ids = [], set()
+        for name, reset_period in cursor.fetchall():
+            id, key = PERIOD_NAME_RE.match(name).groups()
+            if (reset_period not in oldest
+                    or len(key) != len(oldest[reset_period])
+                    or key < oldest[reset_period]):
+                names.append(name)
+                ids.add(int(id))
+        if names:
+            cursor.execute("DROP SEQUENCE IF EXISTS " + ', '.join(names))
+            self._native_period.reset()
+        return sorted(names)
+
+    @stats.timed('create_counter')
+    def create_counter(self, ids):
+        """INSERT the counters of gap-free sequences, starting at their next
+        number
 
+        :param ids: Ids of the ir.sequence
+        """
+        Transaction().cursor.execute("INSERT INTO ir_sequence_counter "
+                "(sequence, number_next) "
+            "SELECT id, number_next FROM ir_sequence WHERE id = ANY(%s)",
+            (list(ids),))
         return True
 
-    def drop_sequence(self, id):
-        """DROP the current sequence"""
-        sequence = self.browse(id)
-        
+    @stats.timed('alter_counter')
+    def alter_counter(self, ids):
+        """Set the counters of gap-free sequences to their next number"""
+        Transaction().cursor.execute("UPDATE ir_sequence_counter "
+            "SET number_next = ir_sequence.number_next "
+            "FROM ir_sequence "
+            "WHERE ir_sequence.id = ir_sequence_counter.sequence "
+                "AND ir_sequence.id = ANY(%s)", (list(ids),))
+        return True
+
+    @stats.timed('drop_counter')
+    def drop_counter(self, ids):
+        """DELETE the counters of gap-free sequences after writing their value
+        back to the next number of the ir.sequence"""
+        cursor = Transaction().cursor
+        cursor.execute("UPDATE ir_sequence "
+            "SET number_next = ir_sequence_counter.number_next "
+            "FROM ir_sequence_counter "
+            "WHERE ir_sequence.id = ir_sequence_counter.sequence "
+                "AND ir_sequence.id = ANY(%s)", (list(ids),))
+        cursor.execute("DELETE FROM ir_sequence_counter "
+            "WHERE sequence = ANY(%s)", (list(ids),))
+        return True
+
+    def reconcile_sequences(self, dry_run=True):
+        """Compare the postgres sequences in database with the ir.sequence
+        records using set-based queries. Unless it is a dry run, the missing
+        postgres sequences are created, the orphaned ones are dropped and the
+        next number of the records is synchronised with the postgres
+        sequences.
+
+        :param dry_run: If True only report the differences
+        :return: A dictionary with the ids of the records missing some of
+            their postgres sequences in `missing`, the names of the orphaned postgres
+            sequences in `orphans` and tuples (id, number_next, native next
+            value) of the records which have drifted in `drift`
+        """
+        self._check_native()
+        self.pool.get('ir.model.access').check(self._name,
+            'read' if dry_run else 'write')
+        cursor = Transaction().cursor
+        cursor.execute("SELECT DISTINCT native.sequence "
+            "FROM (" + native_names_query() + ") AS native "
+            "WHERE NOT EXISTS (SELECT 1 FROM pg_class "
+                "WHERE relkind = 'S' "
+                    "AND relname = native.name "
+                    "AND pg_table_is_visible(pg_class.oid)) "
+            "ORDER BY native.sequence")
+        missing = [id for id, in cursor.fetchall()]
+        cursor.execute("SELECT relname FROM pg_class "
+            "WHERE relkind = 'S' "
+                "AND pg_table_is_visible(pg_class.oid) "
+                "AND ((relname ~ %s "
+                        "AND NOT EXISTS (SELECT 1 "
+                            "FROM (" + native_names_query() + ") AS native "
+                            "WHERE native.name = relname)) "
+                    "OR (relname ~ %s "
+                        "AND NOT EXISTS (SELECT 1 FROM ir_sequence "
+                            "WHERE type = 'postgres_seq' "
+                                "AND COALESCE(reset_period, '') != '' "
+                                "AND id = substring(relname from %s)"
+                                    "::integer))) "
+            "ORDER BY relname",
+            (NATIVE_NAME_PATTERN, PERIOD_NAME_PATTERN, PERIOD_NAME_PATTERN))
+        orphans = [name for name, in cursor.fetchall()]
+        cursor.execute("SELECT ir_sequence.id, ir_sequence.number_next, "
+                "native.number_next "
+            "FROM ir_sequence "
+                "JOIN (" + native_next_query() + ") AS native "
+                    "ON native.sequence = ir_sequence.id "
+            "WHERE ir_sequence.number_next != native.number_next "
+            "ORDER BY ir_sequence.id")
+        drift = cursor.fetchall()
+
+        if not dry_run:
+            if orphans:
+                cursor.execute("DROP SEQUENCE IF EXISTS "
+                    + ', '.join(orphans))
+                self._native_period.reset()
+                self._sequence_descriptor.reset()
+            if missing:
+                # Lay out again the sequences missing some stripes
+                self.alter_sequence(missing, restart=False)
+            if drift:
+                cursor.execute("UPDATE ir_sequence "
+                    "SET number_next = native.number_next "
+                    "FROM (" + native_next_query('id = ANY(%s)') + ") "
+                        "AS native "
+                    "WHERE native.sequence = ir_sequence.id",
+                    ([id for id, _, _ in drift],))
+        return {
+            'missing': missing,
+            'orphans': orphans,
+            'drift': drift,
+        }
+
+    def export_state(self, path):
+        """Write the state of the postgres sequences of the postgres_seq
+        records, with their stripes and periods, to a gzipped JSON file read
+        by import_state. The state is read with a single query, the last
+        value and whether it was called from the relations themselves as
+        pg_sequences does not tell a restarted sequence from a new one.
+
+        :param path: Path of the file
+        :return: The count of postgres sequences exported
+        """
+        self._check_native()
+        cursor = Transaction().cursor
+        cursor.execute("SELECT pg_sequences.sequencename, "
+                "state.last_value, state.is_called, "
+                "pg_sequences.start_value, "
+                "pg_sequences.increment_by, pg_sequences.min_value, "
+                "pg_sequences.max_value, pg_sequences.cache_size, "
+                "pg_sequences.cycle, pg_class.relpersistence = 'u' "
+            "FROM pg_sequences "
+                "CROSS JOIN LATERAL ir_sequence_native_state("
+                    "pg_sequences.sequencename) AS state "
+                "JOIN pg_class "
+                    "ON pg_class.oid = (quote_ident(pg_sequences.schemaname) "
+                        "|| '.' || quote_ident(pg_sequences.sequencename))"
+                        "::regclass "
+            "WHERE pg_sequences.schemaname = current_schema() "
+                "AND (pg_sequences.sequencename ~ %s "
+                    "OR pg_sequences.sequencename ~ %s) "
+                "AND EXISTS (SELECT 1 FROM ir_sequence "
+                    "WHERE type = 'postgres_seq' "
+                        "AND id = substring(pg_sequences.sequencename "
+                            "from '^ir_sequence_([0-9]+)')::integer) "
+            "ORDER BY pg_sequences.sequencename",
+            (NATIVE_NAME_PATTERN, PERIOD_NAME_PATTERN))
+        sequences = [list(row) for row in cursor.fetchall()]
+        file_ = gzip.open(path, 'wb')
+        try:
+            json.dump({
+                    'version': STATE_VERSION,
+                    'sequences': sequences,
+                    }, file_, separators=(',', ':'))
+        finally:
+            file_.close()
+        return len(sequences)
+
+    def import_state(self, path):
+        """Restore the postgres sequences from a file of export_state. The
+        missing postgres sequences are created and those whose options differ
+        are altered in a single batch, then all of them are set with a single
+        setval query and the next number of the ir.sequence follows. The
+        postgres sequences of missing or other ir.sequence are skipped.
+
+        :param path: Path of the file
+        :return: A dictionary with the names of the postgres sequences
+            `created`, `altered` and `skipped`
+        """
+        self._check_native()
+        file_ = gzip.open(path, 'rb')
+        try:
+            state = json.load(file_)
+        finally:
+            file_.close()
+        if state.get('version') != STATE_VERSION:
+            self.raise_user_error('state_version', (state.get('version'),))
+        cursor = Transaction().cursor
+
+        sequences, skipped = {}, []
+        for row in state['sequences']:
+            name = row[0]
+            match = NATIVE_NAME_RE.match(name) or PERIOD_NAME_RE.match(name)
+            if match is None:
+                skipped.append(name)
+                continue
+            sequences[name] = (int(match.group(1)),) + tuple(row[1:])
+        ids = list(set(sequence[0] for sequence in sequences.itervalues()))
+        cursor.execute("SELECT id FROM ir_sequence "
+            "WHERE type = 'postgres_seq' AND id = ANY(%s)", (ids,))
+        ids = set(id for id, in cursor.fetchall())
+        for name in sequences.keys():
+            if sequences[name][0] not in ids:
+                skipped.append(name)
+                del sequences[name]
+
+        cursor.execute("SELECT pg_sequences.sequencename, "
+                "pg_sequences.increment_by, pg_sequences.min_value, "
+                "pg_sequences.max_value, pg_sequences.cache_size, "
+                "pg_sequences.cycle "
+            "FROM pg_sequences "
+            "WHERE pg_sequences.schemaname = current_schema() "
+                "AND pg_sequences.sequencename = ANY(%s)",
+            (sequences.keys(),))
+        existing = dict((row[0], tuple(row[1:])) for row in cursor.fetchall())
+        queries, params, created, altered = [], [], [], []
+        for name, (_, _, _, start, increment, min_value, max_value, cache,
+                cycle, unlogged) in sorted(sequences.iteritems()):
+            options = ("INCREMENT BY %s MINVALUE %s MAXVALUE %s CACHE %s "
+                + ('CYCLE' if cycle else 'NO CYCLE'))
+            options_params = [increment, min_value, max_value, cache]
+            if name not in existing:
+                queries.append("CREATE "
+                    + ('UNLOGGED ' if unlogged else '') + "SEQUENCE " + name
+                    + " " + options + " START WITH %s")
+                params += options_params + [start]
+                created.append(name)
+            elif existing[name] != (increment, min_value, max_value, cache,
+                    cycle):
+                queries.append("ALTER SEQUENCE " + name + " " + options)
+                params += options_params
+                altered.append(name)
+        self._execute_batch(queries, params)
+
+        if sequences:
+            names = sorted(sequences)
+            cursor.execute("SELECT setval(state.name::regclass, "
+                    "state.last_value, state.is_called) "
+                "FROM unnest(%s::varchar[], %s::bigint[], %s::boolean[]) "
+                    "AS state(name, last_value, is_called)",
+                (names, [sequences[name][1] for name in names],
+                    [sequences[name][2] for name in names]))
+            cursor.execute("UPDATE ir_sequence "
+                "SET number_next = native.number_next "
+                "FROM (" + native_next_query('id = ANY(%s)') + ") AS native "
+                "WHERE native.sequence = ir_sequence.id",
+                (list(ids),))
+        self._reset_blocks(list(ids))
+        self._native_period.reset()
+        self._sequence_descriptor.reset()
+        return {
+            'created': created,
+            'altered': altered,
+            'skipped': sorted(skipped),
+        }
+
+    def migrate_to_native(self, domain):
+        """Convert incremental sequences to postgres sequences in one pass.
+        The ir_sequence rows are locked, the postgres sequences are created
+        starting at their next number and the type is switched in the same
+        transaction, so no number can be allocated twice by a concurrent
+        get_id on the incremental type.
+
+        :param domain: A list of ids or a domain of the sequences, the empty
+            domain stands for all the sequences
+        :return: The list of the ids converted
+        """
+        self._check_native()
+        self.pool.get('ir.model.access').check(self._name, 'write')
+        cursor = Transaction().cursor
+        ids = domain
+        if not ids or not all(isinstance(id, (int, long)) for id in ids):
+            ids = self.search(domain)
+        if not ids:
+            return []
+        cursor.execute("SELECT id FROM ir_sequence "
+            "WHERE type = 'incremental' AND id = ANY(%s) "
+            "ORDER BY id FOR UPDATE", (list(ids),))
+        ids = [id for id, in cursor.fetchall()]
+        if not ids:
+            return []
+        self.create_sequence(ids)
+        cursor.execute("UPDATE ir_sequence "
+            "SET type = 'postgres_seq', write_uid = %s, write_date = %s "
+            "WHERE id = ANY(%s)",
+            (Transaction().user, datetime.datetime.now(), ids))
+        self._sequence_descriptor.reset()
+        return ids
+
+    def profile_contention(self, duration=10, interval=0.1):
+        """Sample the lock waits of the other sessions of the database during
+        `duration` seconds and rank the sequences they wait on. A wait is
+        attributed with the ctid of the ir_sequence row locked by the waiting
+        session, the name of the postgres sequence or the text of the query.
+
+        :param duration: Seconds of sampling, at most PROFILE_MAX_DURATION
+        :param interval: Seconds between two samples, at least
+            PROFILE_MIN_INTERVAL and at most the duration
+        :return: A dictionary with the count of `samples`, the count of
+            waits which could not be attributed in `unattributed` and in
+            `sequences` the sequences by decreasing wait with their id, code,
+            name, type, count of waiting sessions sampled, estimated wait in
+            seconds, maximum of concurrent waiters and recommendation
+        """
+        self._check_native()
+        self.pool.get('ir.model.access').check(self._name, 'write')
+        duration = min(max(duration, 0), PROFILE_MAX_DURATION)
+        interval = min(max(interval, PROFILE_MIN_INTERVAL),
+            max(duration, PROFILE_MIN_INTERVAL))
+        waits = {}
+        samples, unattributed = 0, 0
         with Transaction().new_cursor() as transaction:
-            transaction.cursor.execute("""DROP SEQUENCE ir_sequence_%s""", 
-                (id,))
-            transaction.cursor.commit()
+            cursor = transaction.cursor
+            end = time.time() + duration
+            while True:
+                cursor.execute("SELECT pg_stat_clear_snapshot()")
+                cursor.execute("SELECT waiting.relation::regclass::text, "
+                        "ir_sequence.id, activity.query "
+                    "FROM pg_locks AS waiting "
+                        "JOIN pg_stat_activity AS activity "
+                            "ON activity.pid = waiting.pid "
+                        "LEFT JOIN pg_locks AS tuple_lock "
+                            "ON tuple_lock.pid = waiting.pid "
+                                "AND tuple_lock.locktype = 'tuple' "
+                                "AND tuple_lock.relation = "
+                                    "'ir_sequence'::regclass "
+                        "LEFT JOIN ir_sequence "
+                            "ON ir_sequence.ctid = ('(' || tuple_lock.page "
+                                "|| ',' || tuple_lock.tuple || ')')::tid "
+                    "WHERE NOT waiting.granted "
+                        "AND activity.datname = current_database() "
+                        "AND activity.pid != pg_backend_pid()")
+                waiters = {}
+                for relation, sequence_id, query in cursor.fetchall():
+                    sequence_id = attribute_wait(relation, sequence_id, query)
+                    if sequence_id is None:
+                        unattributed += 1
+                    elif sequence_id is not False:
+                        waiters[sequence_id] = waiters.get(sequence_id, 0) + 1
+                for sequence_id, count in waiters.iteritems():
+                    sequence_samples, waiters_max = waits.get(sequence_id,
+                        (0, 0))
+                    waits[sequence_id] = (sequence_samples + count,
+                        max(waiters_max, count))
+                # End the transaction for a new snapshot of the rows
+                cursor.commit()
+                samples += 1
+                if time.time() + interval > end:
+                    break
+                time.sleep(interval)
+
+        with Transaction().set_user(0):
+            sequences = self.read(self.search([('id', 'in', waits.keys())]),
+                ['code', 'name', 'type'])
+        report = []
+        for sequence in sequences:
+            sequence_samples, waiters_max = waits[sequence['id']]
+            report.append({
+                    'id': sequence['id'],
+                    'code': sequence['code'],
+                    'name': sequence['name'],
+                    'type': sequence['type'],
+                    'samples': sequence_samples,
+                    'wait': sequence_samples * interval,
+                    'waiters_max': waiters_max,
+                    'recommendation': self._contention_recommendation(
+                        sequence['type']),
+                    })
+        report.sort(key=lambda sequence: sequence['samples'], reverse=True)
+        return {
+            'samples': samples,
+            'unattributed': unattributed,
+            'sequences': report,
+            }
+
+    def _contention_recommendation(self, type_):
+        "Return the recommended change for a sequence of the type with waits"
+        if type_ == 'incremental':
+            return ('Migrate to postgres_seq with migrate_to_native if gaps '
+                'are acceptable, otherwise to postgres_gapless.')
+        elif type_ == 'postgres_gapless':
+            return ('Allocate the numbers at the end of the transactions or '
+                'use postgres_seq with a block size if gaps are acceptable.')
+        elif type_ == 'postgres_seq':
+            return 'Increase the cache size or the stripes.'
+        return 'Use postgres_seq.'
+
+    def get_deferred(self, domain, model_name, field_name, record_ids):
+        """Request numbers of the sequence for the records. The numbers are
+        allocated in bulk and written to the field of the records at the
+        commit of the transaction, so a rolled back transaction does not use
+        any number and a deleted record gets none.
+
+        :param domain: a domain or a sequence id
+        :param model_name: Name of the model of the records
+        :param field_name: Name of the char field receiving the numbers
+        :param record_ids: Id or list of ids of the records
+        :return: The placeholder token or the list of the tokens of the
+            records, to show until the commit
+        """
+        self._check_native()
+        if isinstance(domain, (int, long)):
+            domain = [('id', '=', domain)]
+        with Transaction().set_context(user=False):
+            with Transaction().set_user(0):
+                sequence_ids = self.search(domain, limit=1)
+                if not sequence_ids:
+                    self.raise_user_error('missing')
+                sequence = self.browse(sequence_ids[0])
+        if not (sequence.type in ('incremental', 'postgres_gapless')
+                or (sequence.type == 'postgres_seq'
+                    and sequence.block_size == 1
+                    and not sequence.reset_period)):
+            self.raise_user_error('deferred_type', (sequence.name,))
+        model_obj = self.pool.get(model_name)
+        if (not isinstance(model_obj, ModelSQL)
+                or not isinstance(model_obj._columns.get(field_name),
+                    fields.Char)):
+            self.raise_user_error('deferred_field', (field_name, model_name))
+
+        ids = [record_ids] if isinstance(record_ids, (int, long)) \
+            else record_ids
+        self._check_deferred_access(model_obj, field_name, ids)
+        cursor = Transaction().cursor
+        cursor.execute("INSERT INTO ir_sequence_deferred "
+                "(sequence, target_table, target_field, record) "
+            "SELECT %s, %s, %s, record "
+            "FROM unnest(%s) WITH ORDINALITY AS records(record, rank) "
+            "ORDER BY rank "
+            "RETURNING id, record",
+            (sequence.id, model_obj._table, field_name, list(ids)))
+        tokens = dict((record, DEFERRED_TOKEN % id)
+            for id, record in cursor.fetchall())
+        if isinstance(record_ids, (int, long)):
+            return tokens[record_ids]
+        return [tokens[id] for id in ids]
+
+    def _check_deferred_access(self, model_obj, field_name, ids):
+        """Check that the user may write the field of the records, as the
+        numbers are written at commit without the ORM: the access to the
+        model and to the field, and the write rules of the records
+
+        :param model_obj: The model of the records
+        :param field_name: Name of the field receiving the numbers
+        :param ids: List of ids of the records
+        """
+        self.pool.get('ir.model.access').check(model_obj._name, 'write')
+        self.pool.get('ir.model.field.access').check(model_obj._name,
+            [field_name], 'write')
+        domain1, domain2 = self.pool.get('ir.rule').domain_get(
+            model_obj._name, mode='write')
+        if domain1 and ids:
+            cursor = Transaction().cursor
+            cursor.execute('SELECT count(*) FROM "' + model_obj._table + '" '
+                'WHERE id = ANY(%s) AND (' + domain1 + ')',
+                [list(set(ids))] + domain2)
+            if cursor.fetchone()[0] != len(set(ids)):
+                self.raise_user_error('deferred_access',
+                    (field_name, model_obj._name))
 
+    def cancel_deferred(self, tokens):
+        """Cancel requests of numbers of the transaction
+
+        :param tokens: List of the tokens returned by get_deferred
+        """
+        self._check_native()
+        ids = [int(token[1:]) for token in tokens]
+        Transaction().cursor.execute("DELETE FROM ir_sequence_deferred "
+            "WHERE id = ANY(%s) AND transaction = txid_current()", (ids,))
         return True
-        
+
+    def get_statistics(self):
+        """Return the statistics of the sequences of the database collected
+        by this process. See stats.snapshot for the format."""
+        return stats.snapshot(Transaction().cursor.database_name)
+
+    def reset_statistics(self):
+        "Clear the statistics of the database collected by this process"
+        self.pool.get('ir.model.access').check(self._name, 'write')
+        stats.reset(Transaction().cursor.database_name)
+        return True
+
+    def enable_statistics(self, enabled=True):
+        """Enable or disable the collection of the statistics in this
+        process. The other processes keep the `sequence_statistics` option
+        of their configuration."""
+        self.pool.get('ir.model.access').check(self._name, 'write')
+        stats.enable(enabled)
+        return True
+
+    def sample_sequences(self, retention=HISTORY_RETENTION):
+        """Record the next number of all the postgres sequences in
+        ir_sequence_history with a single read of pg_sequences and delete the
+        samples older than the retention. It is meant to be called
+        periodically, by a cron or a monitoring probe.
+
+        :param retention: Seconds for which the samples are kept
+        :return: The count of sequences sampled
+        """
+        self._check_native()
+        cursor = Transaction().cursor
+        cursor.execute("INSERT INTO ir_sequence_history "
+                "(sequence, sampled, number_next) "
+            "SELECT native.sequence, now() AT TIME ZONE 'UTC', "
+                "native.number_next "
+            "FROM (" + native_next_query() + ") AS native")
+        sampled = cursor.rowcount
+        cursor.execute("DELETE FROM ir_sequence_history "
+            "WHERE sampled < now() AT TIME ZONE 'UTC' "
+                "- %s * interval '1 second'", (retention,))
+        return sampled
+
+    def forecast_exhaustion(self, horizon=None, sample=True):
+        """Forecast when the postgres sequences will outgrow their padding
+        or reach their maximum value, at the allocation rate between their
+        first and last samples of ir_sequence_history. A cycling sequence
+        wraps around at its maximum value.
+
+        :param horizon: If given, only the sequences forecast to be exhausted
+            within this count of seconds are returned
+        :param sample: If True sample the sequences first
+        :return: A list of dictionaries ordered by date of exhaustion with
+            the id of the `sequence`, its `number_next`, its `rate` in
+            numbers per second, its `limit`, the `reason` of the limit,
+            'padding' or 'max_value', `cycle` and the UTC datetime `exhausted`
+            or None if the sequence is not allocated from
+        """
+        self._check_native()
+        if sample:
+            self.sample_sequences()
+        cursor = Transaction().cursor
+        cursor.execute("SELECT ir_sequence.id, ir_sequence.padding, "
+                "ir_sequence.max_value, ir_sequence.cycle, "
+                "max(history.sampled), "
+                "EXTRACT(EPOCH FROM max(history.sampled) "
+                    "- min(history.sampled))::float, "
+                "(array_agg(history.number_next "
+                    "ORDER BY history.sampled))[1], "
+                "(array_agg(history.number_next "
+                    "ORDER BY history.sampled DESC))[1] "
+            "FROM ir_sequence_history AS history "
+                "JOIN ir_sequence ON ir_sequence.id = history.sequence "
+            "WHERE ir_sequence.type = 'postgres_seq' "
+            "GROUP BY ir_sequence.id")
+        forecasts = []
+        for (id, padding, max_value, cycle, sampled, seconds, first,
+                number_next) in cursor.fetchall():
+            limit, reason = max_value or MAX_BIGINT, 'max_value'
+            if padding and 10 ** padding - 1 < limit:
+                limit, reason = 10 ** padding - 1, 'padding'
+            rate = (number_next - first) / seconds if seconds else 0.0
+            exhausted = None
+            if number_next > limit:
+                exhausted = sampled
+            elif rate > 0:
+                remaining = (limit - number_next + 1) / rate
+                if horizon is not None and remaining > horizon:
+                    continue
+                try:
+                    exhausted = sampled \
+                        + datetime.timedelta(seconds=remaining)
+                except OverflowError:
+                    pass
+            if exhausted is None and horizon is not None:
+                continue
+            forecasts.append({
+                    'sequence': id,
+                    'number_next': number_next,
+                    'rate': rate,
+                    'limit': limit,
+                    'reason': reason,
+                    'cycle': cycle,
+                    'exhausted': exhausted,
+                    })
+        forecasts.sort(key=lambda forecast: (forecast['exhausted'] is None,
+                forecast['exhausted'], forecast['sequence']))
+        return forecasts
+
+    def _sequence_options(self, sequence):
+        """Return the clause and its parameters setting the options of the
+        postgres sequence, common to CREATE and ALTER SEQUENCE
+
+        :param sequence: Dictionary with the OPTION_FIELDS values of the
+            ir.sequence
+        :return: Tuple of the SQL clause and the list of its parameters
+        """
+        clause = ['INCREMENT BY %s', 'CACHE %s']
+        params = [sequence['number_increment'] * sequence['block_size']
+            * sequence['stripes'], sequence['cache_size']]
+        if sequence['min_value']:
+            clause.append('MINVALUE %s')
+            params.append(sequence['min_value'])
+        else:
+            clause.append('NO MINVALUE')
+        if sequence['max_value']:
+            clause.append('MAXVALUE %s')
+            params.append(sequence['max_value'])
+        else:
+            clause.append('NO MAXVALUE')
+        clause.append('CYCLE' if sequence['cycle'] else 'NO CYCLE')
+        return ' '.join(clause), params
+
+    def _persistence_queries(self, sequences):
+        """Return the statements switching the postgres sequences to logged
+        or unlogged where they differ from the ir.sequence. They are only
+        issued on a change so the servers without unlogged sequences keep
+        working.
+
+        :param sequences: List of dictionaries with the id and unlogged values
+            of the ir.sequence
+        :return: Tuple of the list of SQL statements and of their parameters
+        """
+        cursor = Transaction().cursor
+        names = dict((native_name(sequence['id'], stripe), sequence)
+            for sequence in sequences
+            for stripe in xrange(sequence['stripes']))
+        cursor.execute("SELECT relname, relpersistence FROM pg_class "
+            "WHERE relkind = 'S' AND relname = ANY(%s)", (names.keys(),))
+        queries = []
+        for name, persistence in cursor.fetchall():
+            unlogged = names[name]['unlogged']
+            if (persistence == 'u') != bool(unlogged):
+                queries.append("ALTER SEQUENCE " + name + " SET "
+                    + ('UNLOGGED' if unlogged else 'LOGGED'))
+        return queries, []
+
+    @stats.timed('allocate')
     def _get_sequence(self, sequence):
         """If the sequence type is default pass it on to super function else
         call the select sequence.
 
-        :param domain: This may be the id of the sequence or a domain.
+        :param sequence: BrowseRecord of the sequence, or its
+            SequenceDescriptor for the native types
+        """
+        return self._get_number(sequence)
+
+    def _get_number(self, sequence):
+        """Return the next padded number of the sequence, without recording
+        it in the statistics so that _get_sequences records its fallback only
+        once
+
+        :param sequence: BrowseRecord of the sequence, or its
+            SequenceDescriptor for the native types
         """
         if sequence.type == 'postgres_seq':
-            with Transaction().set_user(0):
-                Transaction().cursor.execute("SELECT nextval('ir_sequence_%s')", 
-                    (sequence.id,))
-                next_id = Transaction().cursor.fetchone()
-                return '%%0%sd' % sequence.padding % next_id
+            if sequence.reset_period:
+                next_id = self._nextval(sequence)
+            elif sequence.block_size > 1 and sequence.shared_pool:
+                next_id = self._get_shared_number(sequence)
+            elif sequence.block_size > 1:
+                next_id = self._get_block_number(sequence)
+            else:
+                next_id = self._nextval(sequence)
+            return '%%0%sd' % sequence.padding % next_id
+        elif sequence.type == 'postgres_gapless':
+            next_id, = self._get_counter_numbers(sequence, 1)
+            return '%%0%sd' % sequence.padding % next_id
+        elif sequence.type == 'postgres_snowflake':
+            return '%%0%sd' % sequence.padding % self._snowflake().generate()
         else:
             return super(Sequence, self)._get_sequence(sequence)
 
+    def _get_counter_numbers(self, sequence, count):
+        """Allocate numbers from the counter of a gap-free sequence. The
+        counter row stays locked until the end of the transaction, so the
+        numbers are given back if the transaction is rolled back.
+
+        :param sequence: BrowseRecord or SequenceDescriptor of the sequence
+        :param count: Number of values to allocate
+        :return: List of the allocated numbers
+        """
+        increment = sequence.number_increment
+        cursor = Transaction().cursor
+        cursor.execute("UPDATE ir_sequence_counter "
+            "SET number_next = number_next + %s "
+            "WHERE sequence = %s "
+            "RETURNING number_next - %s",
+            (increment * count, sequence.id, increment * count))
+        row = cursor.fetchone()
+        if row is None:
+            self.raise_user_error('missing_counter', (sequence.id,))
+        number, = row
+        return [number + i * increment for i in xrange(count)]
+
+    def _nextval(self, sequence):
+        """Return the next value of the postgres sequence"""
+        return self._nextvals(sequence, None)[0]
+
+    def _nextvals(self, sequence, count):
+        """Return the next values of the postgres sequence. The prepared
+        statements are used when the OID of the sequence is known. On a
+        backend without sequences the values come from the emulation.
+
+        The OIDs of the cached descriptor are not transactional: they may be
+        those of postgres sequences dropped since, or created by a rolled
+        back transaction. The cache is then reset and the values allocated by
+        name.
+
+        :param sequence: BrowseRecord or SequenceDescriptor of the sequence
+        :param count: Number of values or None for a single value
+        :return: List of the values
+        """
+        stripe = self._stripe(sequence)
+        name = native_name(sequence.id, stripe)
+        oids = None
+        if emulation() is not None:
+            if sequence.reset_period:
+                name = self._period_sequence(sequence)
+            else:
+                name = native_name(sequence.id)
+            with Transaction().set_user(0):
+                return emulation().nextvals(Transaction().cursor, name,
+                    count or 1)
+        if sequence.reset_period:
+            name = self._period_sequence(sequence)
+        elif isinstance(sequence, SequenceDescriptor):
+            oids = sequence.oids
+        with Transaction().set_user(0):
+            cursor = Transaction().cursor
+            if oids:
+                self._prepare(cursor)
+                try:
+                    if count is None:
+                        cursor.execute("EXECUTE ir_sequence_nextval(%s)",
+                            (oids[stripe],))
+                    else:
+                        cursor.execute("EXECUTE ir_sequence_nextvals(%s, %s)",
+                            (oids[stripe], count))
+                except Exception:
+                    # The relation was dropped by a transaction committed
+                    # during the statement, the transaction is aborted but
+                    # its retry must not use the OID again
+                    self._sequence_descriptor.reset()
+                    raise
+                values = [row[0] for row in cursor.fetchall()]
+                if values:
+                    return values
+                self._sequence_descriptor.reset()
+            if count is None:
+                cursor.execute("SELECT nextval(%s)", (name,))
+            else:
+                cursor.execute("SELECT nextval(%s) "
+                    "FROM generate_series(1, %s)", (name, count))
+            return [row[0] for row in cursor.fetchall()]
+
+    def _prepare(self, cursor):
+        """Prepare the statements of PREPARE_SQL on the connection of the
+        cursor unless already done"""
+        connection = cursor._conn
+        if connection not in _PREPARED:
+            cursor.execute(PREPARE_SQL)
+            _PREPARED[connection] = True
+
+    def _native_oids(self, sequence_id, stripes):
+        """Return the OIDs of the postgres sequences of the stripes or None
+        if one of them is missing
+
+        :param sequence_id: Id of the ir.sequence
+        :param stripes: Count of stripes
+        """
+        cursor = Transaction().cursor
+        cursor.execute("SELECT "
+            + ', '.join(["to_regclass(%s)::oid"] * stripes),
+            [native_name(sequence_id, stripe) for stripe in xrange(stripes)])
+        oids = cursor.fetchone()
+        if None in oids:
+            return None
+        return tuple(oids)
+
+    def _stripe(self, sequence):
+        """Return the stripe used by the current thread of this process. Each
+        thread sticks to a stripe so the server processes spread over them.
+        """
+        if sequence.stripes == 1:
+            return 0
+        return hash((os.getpid(), threading.current_thread().ident)) \
+            % sequence.stripes
+
+    def _get_block_number(self, sequence):
+        """Return the next number of the block reserved by this process. A
+        new block is reserved with nextval once the current one is exhausted.
+        The postgres sequence increments by number_increment * block_size so
+        each nextval hands over block_size numbers to a single process.
+
+        :param sequence: BrowseRecord or SequenceDescriptor of the sequence
+        """
+        key = (os.getpid(), Transaction().cursor.database_name, sequence.id)
+        with _BLOCKS_LOCK:
+            lock = _BLOCK_LOCKS.get(key)
+            if lock is None:
+                lock = _BLOCK_LOCKS[key] = threading.Lock()
+        # The refill of a sequence only blocks the allocations of that
+        # sequence
+        with lock:
+            with _BLOCKS_LOCK:
+                number, remaining = _BLOCKS.get(key, (None, 0))
+            if not remaining:
+                number = self._nextval(sequence)
+                remaining = sequence.block_size
+            with _BLOCKS_LOCK:
+                _BLOCKS[key] = (number + sequence.number_increment,
+                    remaining - 1)
+        return number
+
+    def _get_shared_number(self, sequence):
+        """Return the next number of the block shared by the processes of
+        the host. The process which finds the block exhausted reserves a new
+        one with nextval.
+
+        The block is tagged with the OID of the postgres sequence, so a block
+        left in the file by a dropped, restored or cloned database of the
+        same name is not handed out.
+
+        :param sequence: BrowseRecord or SequenceDescriptor of the sequence
+        """
+        if isinstance(sequence, SequenceDescriptor):
+            oids = sequence.oids
+        elif emulation() is None:
+            oids = self._native_oids(sequence.id, sequence.stripes)
+        else:
+            oids = None
+        return self._shared_pool(sequence.id).allocate(
+            lambda: self._nextval(sequence), sequence.number_increment,
+            sequence.block_size, tag=oids[0] if oids else 0)
+
+    def _shared_pool(self, sequence_id, create=True):
+        """Return the SharedPool of the sequence opened by this process. Its
+        file is stored in the data path of the database.
+
+        :param sequence_id: Id of the ir.sequence
+        :param create: If False return None instead of creating the file
+        """
+        database_name = Transaction().cursor.database_name
+        key = (os.getpid(), database_name, sequence_id)
+        with _BLOCKS_LOCK:
+            pool = _SHARED_POOLS.get(key)
+            if pool is None:
+                path = os.path.join(CONFIG['data_path'], database_name,
+                    'sequence_postgres', '%s.pool' % sequence_id)
+                if not create and not os.path.exists(path):
+                    return None
+                pool = _SHARED_POOLS[key] = SharedPool(path)
+        return pool
+
+    def _reset_blocks(self, ids):
+        """Forget the blocks reserved by this process for the sequences and
+        empty their shared pools
+
+        :param ids: List of ids of ir.sequence
+        """
+        database_name = Transaction().cursor.database_name
+        with _BLOCKS_LOCK:
+            for id in ids:
+                _BLOCKS.pop((os.getpid(), database_name, id), None)
+        for id in ids:
+            pool = self._shared_pool(id, create=False)
+            if pool is not None:
+                pool.reset()
+
+    def _snowflake(self):
+        """Return the snowflake generator of this process for the database.
+        Its node id is leased on first use with a session advisory lock on a
+        connection kept by the process, so a node id is never used by two
+        running processes. The search for a free node id starts from the
+        cycling postgres sequence ir_sequence_snowflake_node so that the node
+        ids are handed out in turn. A user error is raised when the
+        MAX_NODE + 1 node ids are all leased.
+        """
+        database_name = Transaction().cursor.database_name
+        key = (os.getpid(), database_name)
+        with _SNOWFLAKES_LOCK:
+            if key not in _SNOWFLAKES:
+                # The lease outlives the transactions, so it is held by a
+                # cursor of its own which is never closed
+                cursor = Database(database_name).connect().cursor(
+                    autocommit=True)
+                cursor.execute("SELECT nextval('ir_sequence_snowflake_node')")
+                start, = cursor.fetchone()
+                for offset in xrange(MAX_NODE + 1):
+                    node = (start + offset) % (MAX_NODE + 1)
+                    cursor.execute("SELECT pg_try_advisory_lock("
+                            "'ir_sequence_snowflake_node'::regclass::oid"
+                                "::integer, %s)", (node,))
+                    if cursor.fetchone()[0]:
+                        break
+                else:
+                    cursor.close()
+                    self.raise_user_error('snowflake_node', (MAX_NODE + 1,))
+                _SNOWFLAKES[key] = Snowflake(node), cursor
+        return _SNOWFLAKES[key][0]
+
+    @stats.timed('allocate', counted=True)
+    def _get_sequences(self, sequence, count):
+        """Return `count` padded numbers of the sequence. Postgres sequences
+        and gap-free counters are allocated with a single statement, the other
+        types and the postgres sequences with a block size fall back on one
+        call to _get_number per number.
+
+        :param sequence: BrowseRecord or SequenceDescriptor of the sequence
+        :param count: Number of values to allocate
+        :return: List of padded numbers in allocation order
+        """
+        if sequence.type == 'postgres_seq' and (sequence.block_size == 1
+                or sequence.reset_period):
+            return ['%%0%sd' % sequence.padding % next_id
+                for next_id in self._nextvals(sequence, count)]
+        elif sequence.type == 'postgres_gapless':
+            return ['%%0%sd' % sequence.padding % next_id
+                for next_id in self._get_counter_numbers(sequence, count)]
+        elif sequence.type == 'postgres_snowflake':
+            return ['%%0%sd' % sequence.padding % next_id
+                for next_id in self._snowflake().generate_many(count)]
+        return [self._get_number(sequence) for _ in xrange(count)]
+
+    @Cache('ir_sequence.sequence_descriptor')
+    def _sequence_descriptor(self, field, value):
+        """Return the SequenceDescriptor of the sequence found by id or code
+        as get_id would find it. The cache is reset by create, write and
+        delete which also resets it in the other processes, and by
+        alter_sequence and drop_sequence as it holds the OIDs of the postgres
+        sequences.
+
+        :param field: 'id' or 'code'
+        :param value: The id or the code of the sequence
+        :return: A SequenceDescriptor or None if the sequence is missing
+        """
+        # bypass rules on sequences
+        with Transaction().set_context(user=False):
+            with Transaction().set_user(0):
+                sequence_ids = self.search([(field, '=', value)], limit=1)
+                if not sequence_ids:
+                    return None
+                sequence = self.browse(sequence_ids[0])
+                oids = None
+                if sequence.type == 'postgres_seq' and emulation() is None:
+                    oids = self._native_oids(sequence.id, sequence.stripes)
+                return SequenceDescriptor(sequence.id, sequence.type,
+                    sequence.padding, sequence.prefix, sequence.suffix,
+                    sequence.number_increment, sequence.block_size,
+                    sequence.stripes, sequence.shared_pool, oids,
+                    sequence.reset_period)
+
+    def _get_native(self, sequence, count=None):
+        """Return the formatted value of a native sequence from its
+        descriptor, or a list of `count` values if count is given
+
+        :param sequence: SequenceDescriptor of the sequence
+        :param count: Number of values to allocate
+        """
+        date = Transaction().context.get('date')
+        if count is None and not date and sequence.type == 'postgres_gapless':
+            # Allocated and formatted by the database in a single call. The
+            # postgres sequences use the prepared nextval instead.
+            cursor = Transaction().cursor
+            cursor.execute("SELECT ir_sequence_next(%s)", (sequence.id,))
+            return cursor.fetchone()[0]
+        prefix = self._process(sequence.prefix, date=date)
+        suffix = self._process(sequence.suffix, date=date)
+        if count is None:
+            return '%s%s%s' % (prefix, self._get_sequence(sequence), suffix)
+        return ['%s%s%s' % (prefix, number, suffix)
+            for number in self._get_sequences(sequence, count)]
+
+    @stats.timed('get_id')
+    def get_id(self, domain):
+        """Return sequence value for the domain. The native sequences given
+        by id are allocated from their cached descriptor.
+
+        :param domain: a domain or a sequence id
+        :return: the sequence value
+        """
+        if isinstance(domain, (int, long)):
+            sequence = self._sequence_descriptor('id', domain)
+            if sequence is not None and sequence.type in NATIVE_TYPES:
+                return self._get_native(sequence)
+        return super(Sequence, self).get_id(domain)
+
+    @stats.timed('get')
+    def get(self, code):
+        """Return sequence value for the code. The native sequences are
+        allocated from their cached descriptor.
+
+        :param code: Code of the sequence
+        :return: the sequence value
+        """
+        sequence = self._sequence_descriptor('code', code)
+        if sequence is not None and sequence.type in NATIVE_TYPES:
+            return self._get_native(sequence)
+        return super(Sequence, self).get(code)
+
+    @stats.timed('get_ids', counted=True)
+    def get_ids(self, domain, count):
+        """Return `count` sequence values for the domain
+
+        :param domain: a domain or a sequence id
+        :param count: Number of values to allocate
+        :return: List of the sequence values
+        """
+        if isinstance(domain, (int, long)):
+            sequence = self._sequence_descriptor('id', domain)
+            if sequence is not None and sequence.type in NATIVE_TYPES:
+                return self._get_native(sequence, count)
+            domain = [('id', '=', domain)]
+
+        # bypass rules on sequences
+        with Transaction().set_context(user=False):
+            with Transaction().set_user(0):
+                sequence_ids = self.search(domain, limit=1)
+            date = Transaction().context.get('date')
+            if sequence_ids:
+                with Transaction().set_user(0):
+                    sequence = self.browse(sequence_ids[0])
+                prefix = self._process(sequence.prefix, date=date)
+                suffix = self._process(sequence.suffix, date=date)
+                return ['%s%s%s' % (prefix, number, suffix)
+                    for number in self._get_sequences(sequence, count)]
+        self.raise_user_error('missing')
+
+    @stats.timed('get_many', counted=True)
+    def get_many(self, code, count):
+        """Return `count` sequence values for the sequence code
+
+        :param code: Code of the sequence
+        :param count: Number of values to allocate
+        :return: List of the sequence values
+        """
+        sequence = self._sequence_descriptor('code', code)
+        if sequence is not None and sequence.type in NATIVE_TYPES:
+            return self._get_native(sequence, count)
+        return self.get_ids([('code', '=', code)], count)
+
 Sequence()
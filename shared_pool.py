@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+"""
+    Shared block pool
+
+    The block of numbers reserved for a postgres sequence kept in a memory
+    mapped file shared by all the server processes of a host.
+
+    :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Ltd..
+    :license: GPLv3, see LICENSE for more details.
+"""
+import os
+import mmap
+import fcntl
+import struct
+import threading
+
+# Next number to hand out, count of numbers left in the block and tag of the
+# source the block was reserved from
+BLOCK = struct.Struct('=qqq')
+
+
+class SharedPool(object):
+    """A block of numbers shared by the processes mapping the same file. The
+    numbers are bumped under an exclusive lock of the file and only the
+    process which finds the block exhausted refills it.
+
+    An instance must not be shared across a fork: the lock of the file is
+    held by the open file which the child would share with its parent.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the file, created if missing
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process
+                if not os.path.isdir(directory):
+                    raise
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        if os.fstat(self.fd).st_size < BLOCK.size:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self.fd).st_size < BLOCK.size:
+                    os.ftruncate(self.fd, BLOCK.size)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, BLOCK.size)
+        # flock does not exclude the threads sharing the file descriptor
+        self.lock = threading.Lock()
+
+    def allocate(self, refill, increment, block_size, tag=0):
+        """Return the next number of the block, refilling it if exhausted or
+        if it was reserved from another source
+
+        :param refill: Function returning the first number of a new block
+        :param increment: Increment between two numbers of the block
+        :param block_size: Count of numbers of a new block
+        :param tag: Integer identifying the source of the numbers, a block
+            left by a former source with the same file is discarded
+        """
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                number, remaining, block_tag = BLOCK.unpack_from(self.map)
+                if remaining <= 0 or block_tag != tag:
+                    number = refill()
+                    remaining = block_size
+                BLOCK.pack_into(self.map, 0, number + increment,
+                    remaining - 1, tag)
+                return number
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def reset(self):
+        "Empty the block so that the next allocation refills it"
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                BLOCK.pack_into(self.map, 0, 0, 0, 0)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
@@ -0,0 +1,71 @@
+# -*- encoding: utf-8 -*-
+"""
+    Snowflake ids
+
+    Time-ordered 64-bit ids generated in process from a timestamp, a node id
+    and a counter, without any call to the database.
+
+    :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Ltd..
+    :license: GPLv3, see LICENSE for more details.
+"""
+import time
+import threading
+
+# Milliseconds since the epoch of 2011-01-01 UTC
+EPOCH = 1293840000000
+
+TIMESTAMP_BITS = 41
+NODE_BITS = 10
+COUNTER_BITS = 12
+
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_COUNTER = (1 << COUNTER_BITS) - 1
+
+
+def time_ms():
+    "Return the current time in milliseconds"
+    return int(time.time() * 1000)
+
+
+class Snowflake(object):
+    """Generate unique and increasing ids for a node. An id is made of the
+    milliseconds since EPOCH, the node id and a counter of the ids generated
+    in the same millisecond.
+
+    The timestamp is a logical clock: it never goes back when the system
+    clock does, instead the ids keep being generated from the last timestamp
+    and the counter overflows on the next millisecond.
+    """
+
+    def __init__(self, node, clock=time_ms):
+        """
+        :param node: Id of the node, unique among the running generators
+        :param clock: Function returning the current time in milliseconds
+        """
+        if not 0 <= node <= MAX_NODE:
+            raise ValueError('Node must be between 0 and %s' % MAX_NODE)
+        self.node = node
+        self.clock = clock
+        self.timestamp = 0
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def generate(self):
+        "Return the next id"
+        with self.lock:
+            now = self.clock()
+            if now > self.timestamp:
+                self.timestamp = now
+                self.counter = 0
+            else:
+                # Same millisecond or clock regression
+                self.counter += 1
+                if self.counter > MAX_COUNTER:
+                    self.timestamp += 1
+                    self.counter = 0
+            return ((self.timestamp - EPOCH) << (NODE_BITS + COUNTER_BITS)) \
+                | (self.node << COUNTER_BITS) | self.counter
+
+    def generate_many(self, count):
+        "Return a list of the `count` next ids"
+        return [self.generate() for _ in xrange(count)]
@@ -0,0 +1,151 @@
+# -*- encoding: utf-8 -*-
+"""
+    Sequence statistics
+
+    Per sequence call counts, numbers issued and latency histograms kept in
+    the memory of the process. They are collected only once enabled, with
+    the `sequence_statistics = True` option of the trytond configuration or
+    with enable.
+
+    :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Ltd..
+    :license: GPLv3, see LICENSE for more details.
+"""
+import time
+import logging
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+from trytond.config import CONFIG
+from trytond.transaction import Transaction
+
+ENABLED = str(CONFIG.options.get('sequence_statistics', False)) == 'True'
+
+# Upper bounds in seconds of the buckets of the histograms, the last bucket
+# counts the latencies above the last bound
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0)
+
+_STATISTICS = {}
+_LOCK = threading.Lock()
+_HOOKS = []
+
+
+class Statistic(object):
+    "Counters and latency histogram of an operation on a sequence"
+    __slots__ = ('calls', 'numbers', 'seconds', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.numbers = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, numbers, seconds):
+        self.calls += 1
+        self.numbers += numbers
+        self.seconds += seconds
+        self.histogram[bisect_left(BUCKETS, seconds)] += 1
+
+
+def enable(enabled=True):
+    "Enable or disable the collection in this process"
+    global ENABLED
+    ENABLED = bool(enabled)
+
+
+def register_hook(hook):
+    """Register a function called on each record with the database name, the
+    operation, the sequence, the count of numbers and the seconds. Hooks run
+    in the thread of the allocation, they must be quick."""
+    if hook not in _HOOKS:
+        _HOOKS.append(hook)
+
+
+def unregister_hook(hook):
+    if hook in _HOOKS:
+        _HOOKS.remove(hook)
+
+
+def record(database_name, operation, sequence, numbers, seconds):
+    """Record a call
+
+    :param database_name: Name of the database
+    :param operation: Name of the operation
+    :param sequence: Id or code of the sequence, None for a batch of
+        sequences
+    :param numbers: Count of numbers issued or of sequences of the batch
+    :param seconds: Duration of the call
+    """
+    key = (database_name, operation, sequence)
+    with _LOCK:
+        statistic = _STATISTICS.get(key)
+        if statistic is None:
+            statistic = _STATISTICS[key] = Statistic()
+        statistic.add(numbers, seconds)
+    for hook in _HOOKS:
+        try:
+            hook(database_name, operation, sequence, numbers, seconds)
+        except Exception:
+            logging.getLogger('sequence_postgres').exception(
+                'statistics hook %r failed' % hook)
+
+
+def snapshot(database_name):
+    """Return the statistics of the database as a list of dictionaries with
+    the operation, the sequence, the calls, the numbers, the seconds and the
+    counts of the histogram for each bound of BUCKETS and above"""
+    with _LOCK:
+        items = [(key, statistic.calls, statistic.numbers, statistic.seconds,
+                list(statistic.histogram))
+            for key, statistic in _STATISTICS.iteritems()
+            if key[0] == database_name]
+    return [{
+            'operation': operation,
+            'sequence': sequence,
+            'calls': calls,
+            'numbers': numbers,
+            'seconds': seconds,
+            'histogram': histogram,
+            } for (_, operation, sequence), calls, numbers, seconds, histogram
+        in sorted(items)]
+
+
+def reset(database_name=None):
+    "Clear the statistics of the database or of all of them"
+    with _LOCK:
+        for key in _STATISTICS.keys():
+            if database_name is None or key[0] == database_name:
+                del _STATISTICS[key]
+
+
+def timed(operation, counted=False):
+    """Decorator recording the calls of a method of ir.sequence when the
+    collection is enabled. The first argument of the method is a sequence,
+    its id or code, or a list of ids for the batches.
+
+    :param operation: Name of the operation
+    :param counted: If True the second argument is the count of numbers
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, target, *args, **kwargs):
+            if not ENABLED:
+                return func(self, target, *args, **kwargs)
+            start = time.time()
+            result = func(self, target, *args, **kwargs)
+            seconds = time.time() - start
+            if isinstance(target, (int, long, basestring)):
+                sequence, numbers = target, 1
+            elif isinstance(target, list) and all(isinstance(id, (int, long))
+                    for id in target):
+                sequence, numbers = None, len(target)
+            else:
+                sequence, numbers = getattr(target, 'id', None), 1
+            if counted:
+                numbers = args[0] if args else kwargs.get('count', 1)
+            record(Transaction().cursor.database_name, operation, sequence,
+                numbers, seconds)
+            return result
+        return wrapper
+    return decorator
@@ -15,17 +15,31 @@ if os.path.isdir(DIR):
     sys.path.insert(0, os.path.dirname(DIR))
     
 import time
+import shutil
+import tempfile
+import datetime
 import threading
+import multiprocessing
 import unittest2 as unittest
 from Queue import Queue
 
+# The tests run on PostgreSQL unless DB_TYPE=sqlite is set in the
+# environment, in which case the postgres sequences are emulated in an
+# in-memory database
+DB_TYPE = os.environ.get('DB_TYPE', 'postgresql')
 from trytond.config import CONFIG
-CONFIG['db_type'] = 'postgresql'
-CONFIG['db_host'] = 'localhost'
-CONFIG['db_port'] = 5432
-CONFIG['db_user'] = 'tryton20'
-CONFIG['db_password'] = 'tryton'
-from trytond.backend.postgresql import Database
+CONFIG['db_type'] = DB_TYPE
+if DB_TYPE == 'postgresql':
+    CONFIG['db_host'] = 'localhost'
+    CONFIG['db_port'] = 5432
+    CONFIG['db_user'] = 'tryton20'
+    CONFIG['db_password'] = 'tryton'
+    from trytond.backend.postgresql import Database
+    from psycopg2 import OperationalError
+else:
+    from trytond.backend.sqlite import Database
+    from trytond.backend.sqlite.database import \
+        DatabaseOperationalError as OperationalError
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import DB_NAME
 trytond.tests.test_tryton.DB = Database(DB_NAME)
@@ -34,6 +48,41 @@ Pool.test = True
 trytond.tests.test_tryton.POOL = Pool(DB_NAME)
 from trytond.tests.test_tryton import POOL, USER, CONTEXT, test_view
 from trytond.transaction import Transaction
+from trytond.cache import Cache
+from trytond.modules.sequence_postgres.snowflake import Snowflake, \
+    NODE_BITS, COUNTER_BITS, MAX_COUNTER
+from trytond.modules.sequence_postgres.shared_pool import SharedPool
+from trytond.modules.sequence_postgres import benchmark
+from trytond.modules.sequence_postgres import stats
+from trytond.modules.sequence_postgres.sequence import attribute_wait
+
+# The sqlite backend shares a single connection bound to the thread which
+# opened it, so the tests of the concurrent allocations and of the features
+# of postgres only run on PostgreSQL
+postgresql_only = unittest.skipIf(DB_TYPE != 'postgresql',
+    'requires PostgreSQL')
+
+# Connection pools inherited by forked processes. They are kept referenced so
+# that their connections, shared with the parent, are never closed by a child
+_INHERITED_POOLS = []
+
+
+def start_process(target, args):
+    """Start the target in a forked process which opens its own connections
+    to the database
+
+    :param target: Function to run in the process
+    :param args: Arguments of the function
+    :return: The started `multiprocessing.Process`
+    """
+    def bootstrap():
+        database = Database(DB_NAME)
+        _INHERITED_POOLS.append(database._connpool)
+        database._connpool = None
+        target(*args)
+    process = multiprocessing.Process(target=bootstrap)
+    process.start()
+    return process
 
 
 def track_time(func):
@@ -43,7 +92,9 @@ def track_time(func):
     def wrapper(*args, **kwargs):
         start_time = time.time()
         func(*args, **kwargs)
-        print 'Total time taken: ', time.time() - start_time
+        time_taken = time.time() - start_time
+        print 'Total time taken: ', time_taken
+        return time_taken
     return wrapper
 
 
@@ -75,6 +126,33 @@ def get_id_single_txn(sequence_id, repeat=1000, queue=None):
         txn.cursor.commit()
 
 
+@track_time
+def get_ids_single_txn(sequence_id, repeat=1000, batch=100, queue=None):
+    """Same as get_id_single_txn but the numbers are allocated in batches
+    of `batch` using get_ids.
+
+    :param sequence_id: ID of the sequence
+    :param repeat: No of numbers to allocate in total
+    :param batch: No of numbers allocated by each call to get_ids
+    :param queue: If this is a multithread implementation of the test then
+        the regular assert will not work. Hence the id which was returned must
+        be pushed into the queue
+    """
+    sequence_obj = POOL.get('ir.sequence')
+
+    with Transaction().start(DB_NAME, 0, CONTEXT) as txn:
+        expected_id = 1
+        for start in xrange(0, repeat, batch):
+            ids = sequence_obj.get_ids(sequence_id, min(batch, repeat - start))
+            for id in ids:
+                if queue is None:
+                    assert int(id) == expected_id
+                else:
+                    queue.put(int(id))
+                expected_id += 1
+        txn.cursor.commit()
+
+
 @track_time
 def get_id_separate_txn(sequence_id, repeat=1000, queue=None):
     """The redundant process of getting the IDS is separated into a function
@@ -101,6 +179,43 @@ def get_id_separate_txn(sequence_id, repeat=1000, queue=None):
             txn.cursor.commit()
 
 
+@track_time
+def get_id_separate_txn_retry(sequence_id, repeat=1000, queue=None,
+        waits=None, retries=None):
+    """Same as get_id_separate_txn but a transaction which fails because of
+    a concurrent update is rolled back and retried, as a client would do.
+
+    :param sequence_id: ID of the sequence
+    :param repeat: No of times the iterator must run
+    :param queue: The ids returned are pushed into the queue
+    :param waits: If given, the time spent in the transactions which had to
+        be retried and in waiting for the commit is pushed into it
+    :param retries: If given, the sequence id is pushed into it for each
+        transaction which had to be retried
+    """
+    sequence_obj = POOL.get('ir.sequence')
+
+    for _ in xrange(repeat):
+        while True:
+            start_time = time.time()
+            with Transaction().start(DB_NAME, 0, CONTEXT) as txn:
+                try:
+                    id = sequence_obj.get_id(sequence_id)
+                    allocated_time = time.time()
+                    txn.cursor.commit()
+                except OperationalError:
+                    txn.cursor.rollback()
+                    if waits is not None:
+                        waits.put(time.time() - start_time)
+                    if retries is not None:
+                        retries.put(sequence_id)
+                    continue
+            if waits is not None:
+                waits.put(time.time() - allocated_time)
+            queue.put(int(id))
+            break
+
+
 @track_time
 def get_id_separate_txn_code(sequence_code, repeat=1000, queue=None):
     """The redundant process of getting the IDS is separated into a function
@@ -127,6 +242,57 @@ def get_id_separate_txn_code(sequence_code, repeat=1000, queue=None):
             txn.cursor.commit()
 
 
+def generate_snowflakes(node, repeat=1000, queue=None):
+    """Generate ids with a snowflake generator of the node and push them
+    into the queue
+
+    :param node: Node id of the generator
+    :param repeat: No of ids to generate
+    :param queue: Queue receiving the ids
+    """
+    generator = Snowflake(node)
+    for _ in xrange(repeat):
+        queue.put(generator.generate())
+
+
+def allocate_shared(path, native, refills, repeat=1000, queue=None):
+    """Allocate numbers from a shared pool refilled from a fake native
+    sequence and push them into the queue
+
+    :param path: Path of the file of the pool
+    :param native: `multiprocessing.Value` of the fake native sequence
+    :param refills: `multiprocessing.Value` counting the refills
+    :param repeat: No of numbers to allocate
+    :param queue: Queue receiving the numbers
+    """
+    def refill():
+        with native.get_lock():
+            number = native.value
+            native.value += 100
+        with refills.get_lock():
+            refills.value += 1
+        return number
+    pool = SharedPool(path)
+    for _ in xrange(repeat):
+        queue.put(pool.allocate(refill, 1, 100))
+    pool.close()
+
+
+def toggle_type(sequence_id, queue=None):
+    """Switch the sequence to the incremental type and back in a transaction,
+    which drops its postgres sequences with those of its periods
+
+    :param sequence_id: ID of the sequence
+    :param queue: Queue receiving True once the transaction is committed
+    """
+    sequence_obj = POOL.get('ir.sequence')
+    with Transaction().start(DB_NAME, 0, CONTEXT) as txn:
+        sequence_obj.write(sequence_id, {'type': 'incremental'})
+        sequence_obj.write(sequence_id, {'type': 'postgres_seq'})
+        txn.cursor.commit()
+    queue.put(True)
+
+
 class TestSequencePostgres(unittest.TestCase):
     "Test the cases of the sequence"
         
@@ -193,6 +359,7 @@ class TestSequencePostgres(unittest.TestCase):
         # changing values.
         get_id_single_txn(sequence_id)
 
+    @postgresql_only
     @unittest.expectedFailure
     def test_0030_default_sequence_multi_txn(self):
         """Test if the default sequence works like before for multiple transa-
@@ -241,6 +408,108 @@ class TestSequencePostgres(unittest.TestCase):
         # the length of the queue then there are no duplciates
         self.assertEqual(len(set(queue.queue)), len(queue.queue))
 
+    def test_0040_default_sequence_bulk(self):
+        """Test that get_ids falls back on the per call allocation for the
+        default sequence and returns the same numbers"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Bulk',
+                'code': 'test.sequence.type.def.bulk'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0040',
+                'code': sequence_type.code,
+                'padding': 5,
+                'prefix': 'A/',
+                'suffix': '/Z'}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(self.sequence_obj.get_ids(sequence_id, 3),
+                ['A/00001/Z', 'A/00002/Z', 'A/00003/Z'])
+            self.assertEqual(
+                self.sequence_obj.get_many(sequence_type.code, 2),
+                ['A/00004/Z', 'A/00005/Z'])
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0050_gapless_sequence_multi_txn(self):
+        """Test that the gap-free counter hands out every number once to
+        multiple transactions acquiring get_id at the same time. A
+        transaction waits for the lock of the counter row instead of failing,
+        so none of them is retried.
+        """
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Gapless',
+                'code': 'test.sequence.type.gapless.multi'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0050',
+                'code': sequence_type.code,
+                'type': 'postgres_gapless'}) # Values for sequence
+            transaction.cursor.commit()
+
+        # Step 2: two transactions are trying to get the ids at the same time
+        queue, retries = Queue(), Queue()
+        threads = [
+            threading.Thread(
+                target = get_id_separate_txn_retry,
+                args = (sequence_id, 500, queue, None, retries)
+                ) for _ in xrange(2)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+
+        # Ensure that the thousand first numbers were given without gaps
+        # and without retry
+        self.assertEqual(sorted(queue.queue), range(1, 1001))
+        self.assertEqual(list(retries.queue), [])
+
+    @postgresql_only
+    def test_0060_gapless_sequence_lock_wait(self):
+        """Compare the time spent waiting on locks by the incremental type
+        and the gap-free counter under concurrent allocations. Only the
+        transactions allocating from the incremental type may be retried.
+        """
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Lock Wait',
+                'code': 'test.sequence.type.lock.wait'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a sequence of each type
+            sequence_ids = [self.sequence_obj.create({
+                'name': 'Test Sequence 0060 %s' % type_,
+                'code': sequence_type.code,
+                'type': type_})
+                for type_ in ('incremental', 'postgres_gapless')]
+            transaction.cursor.commit()
+
+        # Step 2: four transactions compete for each sequence
+        lock_waits = []
+        retries = Queue()
+        for sequence_id in sequence_ids:
+            queue, waits = Queue(), Queue()
+            threads = [
+                threading.Thread(
+                    target = get_id_separate_txn_retry,
+                    args = (sequence_id, 250, queue, waits, retries)
+                    ) for _ in xrange(4)]
+            [thread.start() for thread in threads]
+            [thread.join() for thread in threads]
+            self.assertEqual(sorted(queue.queue), range(1, 1001))
+            lock_waits.append(sum(waits.queue))
+        self.assertTrue(sequence_ids[1] not in retries.queue)
+        print "Lock wait, incremental: %s, gap-free counter: %s" % \
+            tuple(lock_waits)
+
     def test_0110_postgres_sequence(self):
         """Test if the postgres sequence works"""
         with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
@@ -282,6 +551,7 @@ class TestSequencePostgres(unittest.TestCase):
         # times in the same transaction. 
         get_id_single_txn(sequence_id)
 
+    @postgresql_only
     def test_0130_postgres_sequence_multi_txn(self):
         """Test if the postgres sequence works for multiple transa-
         ctions trying to acquire get_id. This is similar to the previous test
@@ -330,6 +600,275 @@ class TestSequencePostgres(unittest.TestCase):
         # the length of the queue then there are no duplciates
         self.assertEqual(len(set(queue.queue)), len(queue.queue))
         
+    def test_0140_postgres_sequence_bulk(self):
+        """Test that get_ids on a postgres sequence returns formatted numbers
+        and compare its throughput with get_id"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Bulk',
+                'code': 'test.sequence.type.pg.bulk'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create the sequences
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0140',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'padding': 5,
+                'prefix': 'A/',
+                'suffix': '/Z'}) # Values for sequence
+            per_call_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0140 Per Call',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'})
+            bulk_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0140 Bulk',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'})
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(self.sequence_obj.get_ids(sequence_id, 3),
+                ['A/00001/Z', 'A/00002/Z', 'A/00003/Z'])
+            transaction.cursor.commit()
+
+        # Step 2: Allocate the same amount of numbers per call and in bulk
+        per_call_time = get_id_single_txn(per_call_id, 10000)
+        bulk_time = get_ids_single_txn(bulk_id, 10000, 1000)
+        print "Per call: %s, Bulk: %s" % (per_call_time, bulk_time)
+        self.assertTrue(bulk_time < per_call_time)
+
+    @postgresql_only
+    def test_0150_postgres_sequence_block_multi_txn(self):
+        """Test that a postgres sequence with a block size hands out unique
+        numbers to several threads and processes, each of them allocating
+        from its own blocks.
+        """
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Block',
+                'code': 'test.sequence.type.pg.block'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0150',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'block_size': 10}) # Values for sequence
+            transaction.cursor.commit()
+
+        # Step 2: two threads of this process and two other processes get
+        # the ids at the same time.
+        queue = multiprocessing.Queue()
+        threads = [
+            threading.Thread(
+                target = get_id_separate_txn,
+                args = (sequence_id, 250, queue)
+                ) for _ in xrange(2)]
+        start_time = time.time()
+        processes = [
+            start_process(get_id_separate_txn, (sequence_id, 250, queue))
+            for _ in xrange(2)]
+        [thread.start() for thread in threads]
+        results = [queue.get() for _ in xrange(1000)]
+        [thread.join() for thread in threads]
+        [process.join() for process in processes]
+        print "Real end time for two threads and two processes", \
+            time.time() - start_time
+
+        # Ensure that thousand unique results exist
+        self.assertEqual(len(results), 1000)
+        self.assertEqual(len(set(results)), len(results))
+
+    @postgresql_only
+    def test_0160_postgres_sequence_options(self):
+        """Test that the options of the ir.sequence are applied to the
+        postgres sequence on creation and on alteration"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Options',
+                'code': 'test.sequence.type.pg.options'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0160',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'cache_size': 20,
+                'max_value': 3,
+                'cycle': True}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            transaction.cursor.execute("SELECT cache_size, max_value, cycle "
+                "FROM pg_sequences WHERE sequencename = %s",
+                ('ir_sequence_%s' % sequence_id,))
+            self.assertEqual(transaction.cursor.fetchone(), (20, 3, True))
+
+            # Step 2: The sequence cycles once the maximum value is reached
+            self.assertEqual(
+                [int(self.sequence_obj.get_id(sequence_id))
+                    for _ in xrange(4)],
+                [1, 2, 3, 1])
+
+            # Step 3: Alter the options
+            self.sequence_obj.write(sequence_id, {
+                'cache_size': 1,
+                'max_value': 0,
+                'cycle': False,
+                })
+            transaction.cursor.execute("SELECT cache_size, max_value, cycle "
+                "FROM pg_sequences WHERE sequencename = %s",
+                ('ir_sequence_%s' % sequence_id,))
+            self.assertEqual(transaction.cursor.fetchone(),
+                (1, 9223372036854775807, False))
+            transaction.cursor.commit()
+
+    def test_0170_postgres_sequence_code_cache(self):
+        """Compare get by code, served from the cached sequence descriptor,
+        with the lookup of the sequence through the ORM on every call"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Code Cache',
+                'code': 'test.sequence.type.pg.cache'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            self.sequence_obj.create({
+                'name': 'Test Sequence 0170',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) # Values for sequence
+            transaction.cursor.commit()
+
+        # Step 2: get by code uses the cache while get_id with a domain
+        # searches and browses the sequence on each call
+        cached_time = get_id_separate_txn_code(sequence_type.code)
+        queue = Queue()
+        orm_time = get_id_separate_txn(
+            [('code', '=', sequence_type.code)], 1000, queue)
+        self.assertEqual(sorted(queue.queue), range(1001, 2001))
+        print "Cached: %s, ORM lookup: %s" % (cached_time, orm_time)
+
+        # Step 3: a write resets the cache
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            sequence_id = self.sequence_obj.search([
+                ('code', '=', sequence_type.code),
+                ])[0]
+            self.sequence_obj.write(sequence_id, {'prefix': 'C/'})
+            self.assertEqual(self.sequence_obj.get(sequence_type.code),
+                'C/2001')
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0180_postgres_sequence_sql_function(self):
+        """Test that the SQL functions return the same formatted values as
+        the ORM"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type SQL Function',
+                'code': 'test.sequence.type.pg.function'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0180',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'padding': 4,
+                'prefix': 'A/${year}/',
+                'suffix': '/$$'}) # Values for sequence
+            transaction.cursor.commit()
+
+        year = datetime.date.today().strftime('%Y')
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            transaction.cursor.execute("SELECT ir_sequence_next(%s)",
+                (sequence_id,))
+            self.assertEqual(transaction.cursor.fetchone()[0],
+                'A/%s/0001/$' % year)
+            transaction.cursor.execute("SELECT ir_sequence_next_code(%s)",
+                (sequence_type.code,))
+            self.assertEqual(transaction.cursor.fetchone()[0],
+                'A/%s/0002/$' % year)
+            self.assertEqual(self.sequence_obj.get_id(sequence_id),
+                'A/%s/0003/$' % year)
+            self.assertEqual(self.sequence_obj.get(sequence_type.code),
+                'A/%s/0004/$' % year)
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0190_postgres_sequence_striped_multi_txn(self):
+        """Test that a striped postgres sequence hands out unique numbers to
+        an increasing number of concurrent processes and compare the time
+        taken with a single stripe"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Striped',
+                'code': 'test.sequence.type.pg.striped'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create the sequences
+            single_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0190 Single',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'})
+            striped_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0190 Striped',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'stripes': 4}) # Values for sequence
+            transaction.cursor.commit()
+
+        # Step 2: Each stripe starts one increment after the previous one
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            transaction.cursor.execute("SELECT sequencename, start_value, "
+                    "increment_by "
+                "FROM pg_sequences WHERE sequencename LIKE %s "
+                "ORDER BY start_value", ('ir_sequence_%s%%' % striped_id,))
+            self.assertEqual(transaction.cursor.fetchall(), [
+                    ('ir_sequence_%s' % striped_id, 1, 4),
+                    ('ir_sequence_%s_1' % striped_id, 2, 4),
+                    ('ir_sequence_%s_2' % striped_id, 3, 4),
+                    ('ir_sequence_%s_3' % striped_id, 4, 4),
+                    ])
+
+        # Step 3: 8, 16 and 32 processes get the ids at the same time
+        for workers in (8, 16, 32):
+            timings = {}
+            for sequence_id in (single_id, striped_id):
+                queue = multiprocessing.Queue()
+                start_time = time.time()
+                processes = [
+                    start_process(get_id_separate_txn,
+                        (sequence_id, 100, queue))
+                    for _ in xrange(workers)]
+                results = [queue.get() for _ in xrange(workers * 100)]
+                [process.join() for process in processes]
+                timings[sequence_id] = time.time() - start_time
+
+                # Ensure that all the results are unique
+                self.assertEqual(len(set(results)), len(results))
+            print "%s processes, single: %s, striped: %s" % (workers,
+                timings[single_id], timings[striped_id])
+
+        # Step 4: Reducing the stripes lays the sequence out again from its
+        # highest next value
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.sequence_obj.write(striped_id, {'stripes': 1})
+            transaction.cursor.execute("SELECT count(*) FROM pg_sequences "
+                "WHERE sequencename LIKE %s", ('ir_sequence_%s%%' % striped_id,))
+            self.assertEqual(transaction.cursor.fetchone()[0], 1)
+            number = int(self.sequence_obj.get_id(striped_id))
+            self.assertTrue(number > (8 + 16 + 32) * 100)
+            transaction.cursor.commit()
+
     def test_0200_toggle_type(self):
         """Toggle the type of sequence from postgres to default to postgres
         should not break the module
@@ -352,13 +891,1159 @@ class TestSequencePostgres(unittest.TestCase):
             self.sequence_obj.write(sequence_id, {'type': 'incremental'})
             self.sequence_obj.write(sequence_id, {'type': 'postgres_seq'})
             transaction2.cursor.commit()
-            
 
-def suite():
-    "Sequence Postgres test suite"
-    suite = trytond.tests.test_tryton.suite()
-    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
-        TestSequencePostgres
+    @postgresql_only
+    def test_0210_reconcile_sequences(self):
+        """Test that the missing, orphaned and drifted postgres sequences
+        are reported and repaired"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Reconcile',
+                'code': 'test.sequence.type.reconcile'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create the sequences
+            missing_id, drift_id = [self.sequence_obj.create({
+                'name': 'Test Sequence 0210 %s' % i,
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) for i in xrange(2)]
+            transaction.cursor.commit()
+
+        # Step 2: Break the postgres sequences
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            cursor = transaction.cursor
+            cursor.execute("DROP SEQUENCE ir_sequence_%s", (missing_id,))
+            cursor.execute("CREATE SEQUENCE ir_sequence_999999")
+            self.sequence_obj.get_ids(drift_id, 5)
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            report = self.sequence_obj.reconcile_sequences()
+            self.assertTrue(missing_id in report['missing'])
+            self.assertTrue('ir_sequence_999999' in report['orphans'])
+            self.assertTrue((drift_id, 1, 6) in report['drift'])
+
+            # Step 3: Repair
+            self.sequence_obj.reconcile_sequences(dry_run=False)
+            report = self.sequence_obj.reconcile_sequences()
+            self.assertEqual(report,
+                {'missing': [], 'orphans': [], 'drift': []})
+            self.assertEqual(
+                self.sequence_obj.read(drift_id, ['number_next']
+                    )['number_next'], 6)
+            self.assertEqual(self.sequence_obj.get_id(missing_id), '1')
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0220_number_next_live(self):
+        """Test that the live next number follows the postgres sequences and
+        that writing it sets the postgres sequences"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Live',
+                'code': 'test.sequence.type.live'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a sequence of each type
+            sequence_ids = [self.sequence_obj.create({
+                'name': 'Test Sequence 0220 %s' % type_,
+                'code': sequence_type.code,
+                'type': type_})
+                for type_ in ('incremental', 'postgres_seq',
+                    'postgres_gapless')]
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            for sequence_id in sequence_ids:
+                self.sequence_obj.get_ids(sequence_id, 5)
+            self.assertEqual(
+                [sequence['number_next_live'] for sequence in
+                    self.sequence_obj.read(sequence_ids,
+                        ['number_next_live'])],
+                [6, 6, 6])
+
+            # Step 2: Write the live next number
+            self.sequence_obj.write(sequence_ids, {'number_next_live': 100})
+            self.assertEqual(
+                [self.sequence_obj.get_id(sequence_id)
+                    for sequence_id in sequence_ids],
+                ['100', '100', '100'])
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0230_migrate_to_native(self):
+        """Test that incremental sequences are migrated to postgres sequences
+        while other transactions allocate numbers without duplicates"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Migrate',
+                'code': 'test.sequence.type.migrate'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create incremental sequences
+            sequence_ids = [self.sequence_obj.create({
+                'name': 'Test Sequence 0230 %s' % i,
+                'code': sequence_type.code}) for i in xrange(10)]
+            transaction.cursor.commit()
+
+        # Step 2: Migrate while two transactions are allocating numbers
+        queue = Queue()
+        threads = [
+            threading.Thread(
+                target = get_id_separate_txn_retry,
+                args = (sequence_ids[0], 250, queue)
+                ) for _ in xrange(2)]
+        [thread.start() for thread in threads]
+        time.sleep(1)
+        while True:
+            with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+                try:
+                    migrated_ids = self.sequence_obj.migrate_to_native([
+                        ('code', '=', sequence_type.code),
+                        ])
+                    transaction.cursor.commit()
+                except OperationalError:
+                    transaction.cursor.rollback()
+                    continue
+            break
+        [thread.join() for thread in threads]
+
+        self.assertEqual(sorted(migrated_ids), sorted(sequence_ids))
+        self.assertEqual(sorted(queue.queue), range(1, 501))
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(
+                set(sequence.type for sequence in
+                    self.sequence_obj.browse(sequence_ids)),
+                set(['postgres_seq']))
+            self.assertEqual(self.sequence_obj.get_id(sequence_ids[0]),
+                '501')
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0240_snowflake_sequence_multi_txn(self):
+        """Test that a snowflake sequence hands out padded, increasing and
+        unique ids to several threads and processes"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Snowflake',
+                'code': 'test.sequence.type.snowflake'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0240',
+                'code': sequence_type.code,
+                'type': 'postgres_snowflake',
+                'padding': 20,
+                'prefix': 'S/'}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            ids = self.sequence_obj.get_ids(sequence_id, 3)
+            ids.append(self.sequence_obj.get_id(sequence_id))
+            self.assertTrue(all(id.startswith('S/') and len(id) == 22
+                    for id in ids))
+            self.assertEqual(ids, sorted(ids))
+            # The node id is leased by this process
+            transaction.cursor.execute("SELECT pg_try_advisory_lock("
+                    "'ir_sequence_snowflake_node'::regclass::oid::integer, "
+                    "%s)", (self.sequence_obj._snowflake().node,))
+            self.assertFalse(transaction.cursor.fetchone()[0])
+            transaction.cursor.commit()
+
+        # Step 2: two threads of this process and two other processes get
+        # the ids at the same time.
+        queue = multiprocessing.Queue()
+        threads = [
+            threading.Thread(
+                target = get_id_separate_txn,
+                args = (sequence_id, 250, queue)
+                ) for _ in xrange(2)]
+        processes = [
+            start_process(get_id_separate_txn, (sequence_id, 250, queue))
+            for _ in xrange(2)]
+        [thread.start() for thread in threads]
+        results = [queue.get() for _ in xrange(1000)]
+        [thread.join() for thread in threads]
+        [process.join() for process in processes]
+
+        # Ensure that thousand unique results exist
+        self.assertEqual(len(results), 1000)
+        self.assertEqual(len(set(results)), len(results))
+
+    @postgresql_only
+    def test_0250_postgres_sequence_shared_pool(self):
+        """Test that a postgres sequence with a shared pool hands out unique
+        numbers to several processes and reserves few blocks"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Shared Pool',
+                'code': 'test.sequence.type.pg.shared'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0250',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'block_size': 100,
+                'shared_pool': True}) # Values for sequence
+            transaction.cursor.commit()
+
+        # Step 2: four processes get 10000 ids at the same time
+        queue = multiprocessing.Queue()
+        processes = [
+            start_process(get_id_separate_txn, (sequence_id, 2500, queue))
+            for _ in xrange(4)]
+        results = [queue.get() for _ in xrange(10000)]
+        [process.join() for process in processes]
+        self.assertEqual(len(set(results)), 10000)
+
+        # Ensure that the blocks were not wasted: a single process refills
+        # the shared block once it is exhausted
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            transaction.cursor.execute("SELECT last_value "
+                "FROM ir_sequence_%s" % sequence_id)
+            blocks = transaction.cursor.fetchone()[0] // 100 + 1
+            self.assertEqual(blocks, 100)
+            self.assertEqual(max(results), 10000)
+
+    @postgresql_only
+    def test_0260_postgres_sequence_prepared(self):
+        """Test that the postgres sequences are allocated with the statements
+        prepared on the connection and that the OIDs follow the alteration
+        and the recreation of the postgres sequences"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Prepared',
+                'code': 'test.sequence.type.pg.prepared'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0260',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            cursor = transaction.cursor
+            self.assertEqual(self.sequence_obj.get_id(sequence_id), '1')
+            self.assertEqual(self.sequence_obj.get_ids(sequence_id, 2),
+                ['2', '3'])
+            cursor.execute("SELECT name FROM pg_prepared_statements "
+                "WHERE name LIKE 'ir_sequence_%%' ORDER BY name")
+            self.assertEqual(cursor.fetchall(),
+                [('ir_sequence_nextval',), ('ir_sequence_nextvals',)])
+
+            # Step 2: The postgres sequence is altered
+            self.sequence_obj.write(sequence_id, {'number_next': 10})
+            self.assertEqual(self.sequence_obj.get_id(sequence_id), '10')
+
+            # Step 3: The postgres sequences are recreated with other OIDs
+            self.sequence_obj.write(sequence_id, {'stripes': 2})
+            self.sequence_obj.write(sequence_id, {'type': 'incremental'})
+            self.sequence_obj.write(sequence_id, {'type': 'postgres_seq',
+                    'stripes': 1, 'number_next': 20})
+            self.assertEqual(self.sequence_obj.get_id(sequence_id), '20')
+            transaction.cursor.commit()
+
+    def test_0270_statistics(self):
+        """Test that the allocations and the DDL are counted once the
+        statistics are enabled and only then"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Statistics',
+                'code': 'test.sequence.type.statistics'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            self.sequence_obj.reset_statistics()
+            self.sequence_obj.enable_statistics()
+            try:
+                # Step 1: Create a new sequence and allocate from it
+                sequence_id = self.sequence_obj.create({
+                    'name': 'Test Sequence 0270',
+                    'code': sequence_type.code,
+                    'type': 'postgres_seq'}) # Values for sequence
+                self.sequence_obj.get_id(sequence_id)
+                self.sequence_obj.get_id(sequence_id)
+                self.sequence_obj.get_ids(sequence_id, 10)
+                # Step 2: Allocate in bulk from an incremental sequence
+                incremental_id = self.sequence_obj.create({
+                    'name': 'Test Sequence 0270 Incremental',
+                    'code': sequence_type.code,
+                    'type': 'incremental'})
+                self.sequence_obj.get_ids(incremental_id, 5)
+            finally:
+                self.sequence_obj.enable_statistics(False)
+            self.sequence_obj.get_id(sequence_id)
+
+            statistics = dict(((s['operation'], s['sequence']), s)
+                for s in self.sequence_obj.get_statistics())
+            self.assertEqual(statistics[('get_id', sequence_id)]['calls'], 2)
+            self.assertEqual(statistics[('get_ids', sequence_id)]['numbers'],
+                10)
+            self.assertEqual(statistics[('allocate', sequence_id)]['numbers'],
+                12)
+            self.assertEqual(statistics[('create_sequence', None)]['calls'],
+                1)
+            self.assertEqual(
+                sum(statistics[('get_id', sequence_id)]['histogram']), 2)
+            self.assertEqual(
+                statistics[('allocate', incremental_id)]['calls'], 1)
+            self.assertEqual(
+                statistics[('allocate', incremental_id)]['numbers'], 5)
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0280_profile_contention(self):
+        """Test that the waits of concurrent transactions on an incremental
+        sequence are attributed to it"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Contention',
+                'code': 'test.sequence.type.contention'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0280',
+                'code': sequence_type.code,
+                'type': 'incremental'}) # Values for sequence
+            transaction.cursor.commit()
+
+        # Step 2: Profile while four threads get ids at the same time
+        queue = Queue()
+        threads = [
+            threading.Thread(
+                target = get_id_separate_txn_retry,
+                args = (sequence_id, 200, queue)
+                ) for _ in xrange(4)]
+        [thread.start() for thread in threads]
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            report = self.sequence_obj.profile_contention(2, 0.01)
+        [thread.join() for thread in threads]
+
+        self.assertTrue(report['samples'] > 1)
+        hottest = report['sequences'][0]
+        self.assertEqual(hottest['id'], sequence_id)
+        self.assertEqual(hottest['code'], sequence_type.code)
+        self.assertTrue(hottest['waiters_max'] >= 1)
+        self.assertTrue('migrate_to_native' in hottest['recommendation'])
+
+    @postgresql_only
+    def test_0290_postgres_sequence_reset_period(self):
+        """Test that a postgres sequence with a reset period restarts for
+        each period and that the old periods are purged"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Period',
+                'code': 'test.sequence.type.pg.period'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0290',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'reset_period': 'year',
+                'prefix': 'INV/${year}/',
+                'padding': 5}) # Values for sequence
+            transaction.cursor.commit()
+
+        def get_id(date):
+            with Transaction().set_context(date=date):
+                return self.sequence_obj.get_id(sequence_id)
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            cursor = transaction.cursor
+            self.assertEqual(get_id(datetime.date(2026, 3, 1)),
+                'INV/2026/00001')
+            self.assertEqual(get_id(datetime.date(2026, 12, 31)),
+                'INV/2026/00002')
+            self.assertEqual(get_id(datetime.date(2027, 1, 1)),
+                'INV/2027/00001')
+            self.assertEqual(get_id(datetime.date(2026, 12, 31)),
+                'INV/2026/00003')
+            with Transaction().set_context(date=datetime.date(2027, 1, 2)):
+                self.assertEqual(
+                    self.sequence_obj.get_ids(sequence_id, 2),
+                    ['INV/2027/00002', 'INV/2027/00003'])
+            # The periods are created in separate transactions
+            transaction.cursor.commit()
+            cursor.execute("SELECT relname FROM pg_class "
+                "WHERE relname LIKE %s ORDER BY relname",
+                ('ir_sequence_%s_p%%' % sequence_id,))
+            self.assertEqual(cursor.fetchall(), [
+                    ('ir_sequence_%s_p2026' % sequence_id,),
+                    ('ir_sequence_%s_p2027' % sequence_id,),
+                    ])
+            self.assertEqual(self.sequence_obj.reconcile_sequences()[
+                    'orphans'], [])
+
+            # Step 2: Purge the periods before 2027
+            with Transaction().set_context(date=datetime.date(2027, 6, 1)):
+                self.assertEqual(self.sequence_obj.purge_periods(keep=0),
+                    ['ir_sequence_%s_p2026' % sequence_id])
+            self.assertEqual(get_id(datetime.date(2027, 6, 1)),
+                'INV/2027/00004')
+
+            # Step 3: The periods are dropped with the postgres sequence
+            self.sequence_obj.write(sequence_id, {'type': 'incremental'})
+            cursor.execute("SELECT count(*) FROM pg_class "
+                "WHERE relname LIKE %s", ('ir_sequence_%s_p%%' % sequence_id,))
+            self.assertEqual(cursor.fetchone()[0], 0)
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0295_deferred_assignment(self):
+        """Test that the numbers requested in a transaction are assigned at
+        its commit, only to the remaining records and never on rollback"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Deferred',
+                'code': 'test.sequence.type.deferred'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create the sequences
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0295',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'prefix': 'D/'}) # Values for sequence
+            snowflake_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0295 Snowflake',
+                'code': sequence_type.code,
+                'type': 'postgres_snowflake'})
+            transaction.cursor.commit()
+
+        def create_targets(count):
+            # The records receiving the numbers are sequence types
+            return [self.sequence_type_obj.create({
+                        'name': 'Draft',
+                        'code': 'test.sequence.type.deferred.%s.%s' % (
+                            time.time(), i),
+                        }) for i in xrange(count)]
+
+        # Step 2: A rolled back transaction does not use any number
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            target_ids = create_targets(2)
+            tokens = self.sequence_obj.get_deferred(sequence_id,
+                'ir.sequence.type', 'name', target_ids)
+            self.assertEqual(len(tokens), 2)
+            self.assertTrue(all(token.startswith('#') for token in tokens))
+            self.assertRaises(Exception, self.sequence_obj.get_deferred,
+                snowflake_id, 'ir.sequence.type', 'name', target_ids)
+            transaction.cursor.rollback()
+
+        # Step 3: The numbers are assigned at commit in request order
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            target_ids = create_targets(4)
+            self.sequence_obj.get_deferred(sequence_id, 'ir.sequence.type',
+                'name', target_ids[:2])
+            self.sequence_obj.get_deferred(sequence_id, 'ir.sequence.type',
+                'name', target_ids[2])
+            cancelled = self.sequence_obj.get_deferred(sequence_id,
+                'ir.sequence.type', 'name', target_ids[3])
+            self.sequence_obj.cancel_deferred([cancelled])
+            self.sequence_type_obj.delete(target_ids[1])
+            self.assertEqual(self.sequence_type_obj.read(target_ids[2],
+                    ['name'])['name'], 'Draft')
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            names = [sequence_type['name'] for sequence_type in
+                self.sequence_type_obj.read([target_ids[0], target_ids[2],
+                        target_ids[3]], ['name'])]
+            self.assertEqual(names, ['D/1', 'D/2', 'Draft'])
+            transaction.cursor.execute(
+                "SELECT count(*) FROM ir_sequence_deferred")
+            self.assertEqual(transaction.cursor.fetchone()[0], 0)
+
+    @postgresql_only
+    def test_0300_provision_sequences(self):
+        """Create, write and delete a thousand postgres sequences in a single
+        transaction each and time it"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Provision',
+                'code': 'test.sequence.type.provision'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            transaction.cursor.commit()
+
+        start_time = time.time()
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            sequence_ids = [self.sequence_obj.create({
+                'name': 'Test Sequence 0300 %s' % i,
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) for i in xrange(1000)]
+            transaction.cursor.commit()
+        print "Create 1000 sequences", time.time() - start_time
+
+        start_time = time.time()
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.sequence_obj.write(sequence_ids, {
+                'number_next': 10,
+                'number_increment': 2,
+                })
+            transaction.cursor.commit()
+        print "Write 1000 sequences", time.time() - start_time
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(
+                [self.sequence_obj.get_id(sequence_ids[-1]) for _ in (0, 1)],
+                ['10', '12'])
+            transaction.cursor.execute("SELECT count(*) FROM pg_class "
+                "WHERE relkind = 'S' AND relname = ANY(%s)",
+                (['ir_sequence_%s' % id for id in sequence_ids],))
+            self.assertEqual(transaction.cursor.fetchone()[0], 1000)
+            transaction.cursor.commit()
+
+        start_time = time.time()
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.sequence_obj.delete(sequence_ids)
+            transaction.cursor.commit()
+        print "Delete 1000 sequences", time.time() - start_time
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            transaction.cursor.execute("SELECT count(*) FROM pg_class "
+                "WHERE relkind = 'S' AND relname = ANY(%s)",
+                (['ir_sequence_%s' % id for id in sequence_ids],))
+            self.assertEqual(transaction.cursor.fetchone()[0], 0)
+
+    def test_0310_postgres_sequence_cycle(self):
+        """Test that a postgres sequence cycles at its maximum value and
+        follows its live next number, on PostgreSQL as on the emulation of
+        the other backends"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Cycle',
+                'code': 'test.sequence.type.pg.cycle'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0310',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'number_increment': 2,
+                'max_value': 5,
+                'cycle': True}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(
+                [self.sequence_obj.get_id(sequence_id) for _ in xrange(4)],
+                ['1', '3', '5', '1'])
+            self.assertEqual(self.sequence_obj.read(sequence_id,
+                    ['number_next_live'])['number_next_live'], 3)
+
+            # Step 2: Restart the sequence from its live next number
+            self.sequence_obj.write(sequence_id, {'number_next_live': 5})
+            self.assertEqual(self.sequence_obj.get_ids(sequence_id, 2),
+                ['5', '1'])
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0320_forecast_exhaustion(self):
+        """Test that the exhaustion of the padding of a postgres sequence is
+        forecast from the samples of its next number"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Forecast',
+                'code': 'test.sequence.type.pg.forecast'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0320',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'padding': 3}) # Values for sequence
+            self.assertTrue(self.sequence_obj.sample_sequences() > 0)
+            transaction.cursor.commit()
+
+        # Step 2: Allocate between two samples
+        time.sleep(1)
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.sequence_obj.get_ids(sequence_id, 100)
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            forecasts = dict((forecast['sequence'], forecast) for forecast
+                in self.sequence_obj.forecast_exhaustion())
+            forecast = forecasts[sequence_id]
+            self.assertEqual(forecast['number_next'], 101)
+            self.assertEqual(forecast['limit'], 999)
+            self.assertEqual(forecast['reason'], 'padding')
+            self.assertTrue(forecast['rate'] > 0)
+            self.assertTrue(forecast['exhausted'] is not None)
+
+            # Step 3: The horizon leaves out the distant exhaustions
+            self.assertTrue(sequence_id not in [forecast['sequence']
+                    for forecast in self.sequence_obj.forecast_exhaustion(
+                        horizon=0, sample=False)])
+
+            # Step 4: The samples older than the retention are deleted
+            self.sequence_obj.sample_sequences(retention=0)
+            transaction.cursor.execute("SELECT count(*) "
+                "FROM ir_sequence_history WHERE sequence = %s",
+                (sequence_id,))
+            self.assertEqual(transaction.cursor.fetchone()[0], 1)
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0330_export_import_state(self):
+        """Test that the state of the postgres sequences is exported and
+        restored, creating the missing postgres sequences"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type State',
+                'code': 'test.sequence.type.pg.state'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create the sequences and allocate from them
+            dropped_id, reset_id, restarted_id = [self.sequence_obj.create({
+                'name': 'Test Sequence 0330 %s' % i,
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'number_increment': 2}) for i in xrange(3)]
+            self.sequence_obj.get_ids(dropped_id, 5)
+            self.sequence_obj.get_ids(reset_id, 3)
+            self.sequence_obj.get_ids(restarted_id, 3)
+            self.sequence_obj.write(restarted_id, {'number_next': 50})
+            transaction.cursor.commit()
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'state.json.gz')
+        try:
+            with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+                self.assertTrue(self.sequence_obj.export_state(path) >= 3)
+
+                # Step 2: Lose a postgres sequence and reset the others
+                transaction.cursor.execute("DROP SEQUENCE ir_sequence_%s"
+                    % dropped_id)
+                for id in (reset_id, restarted_id):
+                    transaction.cursor.execute("SELECT setval("
+                        "'ir_sequence_%s', 1, false)" % id)
+
+                # Step 3: Restore them
+                result = self.sequence_obj.import_state(path)
+                self.assertEqual(result['created'],
+                    ['ir_sequence_%s' % dropped_id])
+                self.assertEqual(result['skipped'], [])
+                self.assertEqual(self.sequence_obj.get_id(dropped_id), '11')
+                self.assertEqual(self.sequence_obj.get_id(reset_id), '7')
+                self.assertEqual(self.sequence_obj.get_id(restarted_id),
+                    '50')
+                transaction.cursor.commit()
+        finally:
+            shutil.rmtree(directory)
+
+    @postgresql_only
+    def test_0340_restarted_next_number(self):
+        """Test that the next number of a restarted postgres sequence is
+        neither reported as a drift nor used to lay out the stripes from its
+        start again"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Restart',
+                'code': 'test.sequence.type.pg.restart'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence and restart it
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0340',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) # Values for sequence
+            self.sequence_obj.get_ids(sequence_id, 5)
+            self.sequence_obj.write(sequence_id, {'number_next': 100})
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(self.sequence_obj.read(sequence_id,
+                    ['number_next_live'])['number_next_live'], 100)
+            result = self.sequence_obj.reconcile_sequences()
+            self.assertTrue(sequence_id not in
+                [id for id, _, _ in result['drift']])
+
+            # Step 2: Stripe it again from its live next number
+            self.sequence_obj.alter_sequence(sequence_id, restart=False)
+            self.sequence_obj.write(sequence_id, {'stripes': 2})
+            self.assertTrue(min(int(number) for number
+                    in self.sequence_obj.get_ids(sequence_id, 4)) >= 100)
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0350_stale_oids(self):
+        """Test that the numbers are allocated by name once the OIDs of the
+        cached descriptor are those of a dropped postgres sequence"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Stale',
+                'code': 'test.sequence.type.pg.stale'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0350',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(self.sequence_obj.get_id(sequence_id), '1')
+            # Step 2: Recreate the postgres sequence behind the cache
+            transaction.cursor.execute("DROP SEQUENCE ir_sequence_%s"
+                % sequence_id)
+            transaction.cursor.execute("CREATE SEQUENCE ir_sequence_%s "
+                "START WITH 50" % sequence_id)
+            self.assertEqual(self.sequence_obj.get_id(sequence_id), '50')
+            self.assertEqual(self.sequence_obj.get_ids(sequence_id, 2),
+                ['51', '52'])
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0360_deferred_access(self):
+        """Test that a user can not request numbers for a field without the
+        write access nor run the maintenance of the postgres sequences"""
+        user_obj = POOL.get('res.user')
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Access',
+                'code': 'test.sequence.type.deferred.access'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a sequence and a user without group
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0360',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) # Values for sequence
+            user_id = user_obj.create({
+                'name': 'Test Deferred Access',
+                'login': 'test_deferred_access',
+                'groups': [('set', [])],
+                })
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, user_id, CONTEXT) as transaction:
+            self.assertRaises(Exception, self.sequence_obj.get_deferred,
+                sequence_id, 'res.user', 'login', [user_id])
+            self.assertRaises(Exception,
+                self.sequence_obj.reconcile_sequences, False)
+            self.assertRaises(Exception, self.sequence_obj.purge_periods)
+            self.assertRaises(Exception, self.sequence_obj.migrate_to_native,
+                [sequence_id])
+            self.assertRaises(Exception, self.sequence_obj.enable_statistics)
+            self.assertRaises(Exception, self.sequence_obj.reset_statistics)
+            self.assertRaises(Exception,
+                self.sequence_obj.profile_contention, 0)
+            transaction.cursor.rollback()
+
+    @unittest.skipIf(DB_TYPE == 'postgresql', 'requires an emulation')
+    def test_0370_emulated_block(self):
+        """Test that the emulated postgres sequences refuse a block size and
+        a shared pool"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Emulated Block',
+                'code': 'test.sequence.type.emulated.block'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0370',
+                'code': sequence_type.code,
+                'type': 'postgres_seq'}) # Values for sequence
+            self.assertRaises(Exception, self.sequence_obj.write,
+                sequence_id, {'block_size': 10})
+            self.assertRaises(Exception, self.sequence_obj.write,
+                sequence_id, {'shared_pool': True})
+            transaction.cursor.rollback()
+
+    @postgresql_only
+    def test_0380_smaller_block_size(self):
+        """Test that no number is handed out twice once the block size of a
+        postgres sequence is reduced"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Smaller Block',
+                'code': 'test.sequence.type.smaller.block'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence with a block size
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0380',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'block_size': 10}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            numbers = self.sequence_obj.get_ids(sequence_id, 3)
+            # Step 2: Reduce the block size between two allocations
+            self.sequence_obj.write(sequence_id, {'block_size': 2})
+            numbers += self.sequence_obj.get_ids(sequence_id, 3)
+            self.sequence_obj.write(sequence_id, {'block_size': 1})
+            numbers += self.sequence_obj.get_ids(sequence_id, 3)
+            self.assertEqual(len(set(numbers)), len(numbers))
+            transaction.cursor.commit()
+
+    @postgresql_only
+    def test_0390_period_dropped_by_other_process(self):
+        """Test that the postgres sequence of a period dropped by another
+        process is created again once the caches are cleaned"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Period Dropped',
+                'code': 'test.sequence.type.pg.period.dropped'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0390',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'reset_period': 'year'}) # Values for sequence
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(self.sequence_obj.get_id(sequence_id), '1')
+            transaction.cursor.commit()
+
+        # Step 2: Another process drops the postgres sequences
+        queue = multiprocessing.Queue()
+        process = start_process(toggle_type, (sequence_id, queue))
+        queue.get()
+        process.join()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            Cache.clean(DB_NAME)
+            self.assertEqual(self.sequence_obj.get_id(sequence_id), '1')
+            transaction.cursor.commit()
+
+    @unittest.skipIf(DB_TYPE == 'postgresql', 'requires an emulation')
+    def test_0400_emulated_period(self):
+        """Test that an emulated postgres sequence with a reset period
+        restarts for each period and that the calls on the postgres sequences
+        themselves are refused"""
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            # Step 0: Create a new sequence type
+            sequence_type_id = self.sequence_type_obj.create({
+                'name': 'Test Sequence Type Emulated Period',
+                'code': 'test.sequence.type.emulated.period'
+                })
+            sequence_type = self.sequence_type_obj.browse(sequence_type_id)
+            # Step 1: Create a new sequence
+            sequence_id = self.sequence_obj.create({
+                'name': 'Test Sequence 0400',
+                'code': sequence_type.code,
+                'type': 'postgres_seq',
+                'reset_period': 'month',
+                'prefix': '${year}${month}/'}) # Values for sequence
+            transaction.cursor.commit()
+
+        def get_id(date):
+            with Transaction().set_context(date=date):
+                return self.sequence_obj.get_id(sequence_id)
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            self.assertEqual(get_id(datetime.date(2026, 3, 1)), '202603/1')
+            self.assertEqual(get_id(datetime.date(2026, 3, 31)), '202603/2')
+            self.assertEqual(get_id(datetime.date(2026, 4, 1)), '202604/1')
+            self.assertEqual(get_id(datetime.date(2026, 3, 15)), '202603/3')
+            transaction.cursor.commit()
+
+        with Transaction().start(DB_NAME, 0, CONTEXT) as transaction:
+            with Transaction().set_context(date=datetime.date(2026, 4, 2)):
+                self.assertEqual(self.sequence_obj.get_ids(sequence_id, 2),
+                    ['202604/2', '202604/3'])
+            self.assertTrue(isinstance(self.sequence_obj.get_statistics(),
+                    list))
+            for method in ('reconcile_sequences', 'purge_periods',
+                    'sample_sequences', 'forecast_exhaustion',
+                    'profile_contention'):
+                self.assertRaises(Exception,
+                    getattr(self.sequence_obj, method))
+            transaction.cursor.rollback()
+
+
+class TestSnowflake(unittest.TestCase):
+    "Test the snowflake generator without database"
+
+    def test_0010_monotonic(self):
+        """Test that the ids are strictly increasing and carry the node"""
+        generator = Snowflake(5)
+        ids = [generator.generate() for _ in xrange(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all(
+                (id >> COUNTER_BITS) & ((1 << NODE_BITS) - 1) == 5
+                for id in ids))
+
+    def test_0020_threads(self):
+        """Test that the ids are unique across the threads sharing a
+        generator"""
+        generator = Snowflake(1)
+        queue = Queue()
+        threads = [
+            threading.Thread(
+                target = lambda: [queue.put(generator.generate())
+                    for _ in xrange(1000)]
+                ) for _ in xrange(8)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assertEqual(len(set(queue.queue)), 8000)
+
+    def test_0030_processes(self):
+        """Test that the ids are unique across the processes of different
+        nodes"""
+        queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target = generate_snowflakes,
+                args = (node, 1000, queue)
+                ) for node in xrange(4)]
+        [process.start() for process in processes]
+        results = [queue.get() for _ in xrange(4000)]
+        [process.join() for process in processes]
+        self.assertEqual(len(set(results)), 4000)
+
+    def test_0040_clock_regression(self):
+        """Test that the ids keep increasing when the clock goes back and when
+        the counter overflows"""
+        now = [1400000000000]
+        generator = Snowflake(3, clock=lambda: now[0])
+        first = generator.generate()
+        now[0] -= 5000
+        ids = [generator.generate() for _ in xrange(MAX_COUNTER + 10)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(ids[0] > first)
+        now[0] += 10000
+        self.assertTrue(generator.generate() > ids[-1])
+
+    def test_0050_node_range(self):
+        """Test that the node id must fit in its bits"""
+        self.assertRaises(ValueError, Snowflake, 1 << NODE_BITS)
+        self.assertRaises(ValueError, Snowflake, -1)
+
+
+class TestSharedPool(unittest.TestCase):
+    "Test the shared block pool without database"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pool')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_0010_allocate(self):
+        """Test that the numbers follow each other and the pool is refilled
+        once exhausted"""
+        refills = []
+        def refill():
+            refills.append(1)
+            return len(refills) * 1000
+        pool = SharedPool(self.path)
+        numbers = [pool.allocate(refill, 2, 3) for _ in xrange(4)]
+        self.assertEqual(numbers, [1000, 1002, 1004, 2000])
+        pool.reset()
+        self.assertEqual(pool.allocate(refill, 2, 3), 3000)
+        pool.close()
+
+    def test_0020_processes(self):
+        """Test that forked processes share the pool: the numbers are unique
+        and a block is refilled only once exhausted"""
+        native = multiprocessing.Value('l', 1)
+        refills = multiprocessing.Value('l', 0)
+        queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target = allocate_shared,
+                args = (self.path, native, refills, 2500, queue)
+                ) for _ in xrange(4)]
+        [process.start() for process in processes]
+        results = [queue.get() for _ in xrange(10000)]
+        [process.join() for process in processes]
+        self.assertEqual(sorted(results), range(1, 10001))
+        self.assertEqual(refills.value, 100)
+
+    def test_0030_tag(self):
+        """Test that a block reserved from another source is discarded"""
+        refills = []
+        def refill():
+            refills.append(1)
+            return len(refills) * 1000
+        pool = SharedPool(self.path)
+        self.assertEqual(pool.allocate(refill, 1, 10, tag=1), 1000)
+        self.assertEqual(pool.allocate(refill, 1, 10, tag=1), 1001)
+        pool.close()
+        pool = SharedPool(self.path)
+        self.assertEqual(pool.allocate(refill, 1, 10, tag=2), 2000)
+        pool.close()
+
+
+class TestStatistics(unittest.TestCase):
+    "Test the statistics without database"
+
+    def tearDown(self):
+        stats.reset('test_statistics')
+
+    def test_0010_record(self):
+        """Test the counters and the buckets of the histogram"""
+        stats.record('test_statistics', 'allocate', 1, 1, 0.00005)
+        stats.record('test_statistics', 'allocate', 1, 10, 0.003)
+        stats.record('test_statistics', 'allocate', 1, 1, 5)
+        stats.record('test_statistics', 'get_id', 1, 1, 0.003)
+        statistic, _ = stats.snapshot('test_statistics')
+        self.assertEqual(statistic['operation'], 'allocate')
+        self.assertEqual(statistic['calls'], 3)
+        self.assertEqual(statistic['numbers'], 12)
+        histogram = statistic['histogram']
+        self.assertEqual(len(histogram), len(stats.BUCKETS) + 1)
+        self.assertEqual(histogram[0], 1)
+        self.assertEqual(histogram[stats.BUCKETS.index(0.005)], 1)
+        self.assertEqual(histogram[-1], 1)
+
+        stats.reset('test_statistics')
+        self.assertEqual(stats.snapshot('test_statistics'), [])
+
+    def test_0020_hook(self):
+        """Test that the hooks receive the records and that a failing hook
+        does not break the recording"""
+        records = []
+        def failing(*args):
+            raise ValueError
+        def recording(*args):
+            records.append(args)
+        stats.register_hook(failing)
+        stats.register_hook(recording)
+        try:
+            stats.record('test_statistics', 'allocate', 1, 1, 0.001)
+        finally:
+            stats.unregister_hook(failing)
+            stats.unregister_hook(recording)
+        self.assertEqual(len(stats.snapshot('test_statistics')), 1)
+        self.assertEqual(records,
+            [('test_statistics', 'allocate', 1, 1, 0.001)])
+
+    def test_0030_disabled(self):
+        """Test that nothing is recorded when disabled"""
+        class Model(object):
+            @stats.timed('allocate')
+            def allocate(self, sequence):
+                return sequence
+        stats.enable(False)
+        self.assertEqual(Model().allocate(1), 1)
+        self.assertEqual(stats.snapshot('test_statistics'), [])
+
+
+class TestContention(unittest.TestCase):
+    "Test the attribution of the lock waits without database"
+
+    def test_0010_attribute_wait(self):
+        """Test the attribution by row, by relation and by query"""
+        self.assertEqual(attribute_wait(None, 5, ''), 5)
+        self.assertEqual(attribute_wait('ir_sequence_7', None, ''), 7)
+        self.assertEqual(attribute_wait('ir_sequence_7_2', None, ''), 7)
+        self.assertEqual(attribute_wait('ir_sequence_7_p202610', None, ''), 7)
+        self.assertEqual(attribute_wait(None, None,
+                'UPDATE "ir_sequence" SET "number_next" = 3, '
+                'write_uid = 0 WHERE id IN (12)'), 12)
+        self.assertEqual(attribute_wait('ir_sequence_counter', None,
+                'UPDATE ir_sequence_counter SET number_next = number_next + 1 '
+                'WHERE sequence = 9 RETURNING number_next - 1'), 9)
+        self.assertEqual(attribute_wait('ir_sequence', None,
+                'LOCK TABLE ir_sequence'), None)
+        self.assertEqual(attribute_wait('account_move', None,
+                'UPDATE account_move SET state = 1 WHERE id = 4'), False)
+
+
+class TestBenchmark(unittest.TestCase):
+    "Test the reporting of the benchmark without database"
+
+    def test_0010_summarize(self):
+        """Test the throughput and the percentiles of a run"""
+        summary = benchmark.summarize([0.001] * 98 + [0.005, 0.010], 2.0, 3)
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['errors'], 3)
+        self.assertEqual(summary['throughput'], 50)
+        self.assertAlmostEqual(summary['p50'], 1)
+        self.assertAlmostEqual(summary['p95'], 1)
+        self.assertAlmostEqual(summary['p99'], 5)
+
+    def test_0020_compare(self):
+        """Test that the regressions beyond the tolerance are reported"""
+        baseline = {'scenarios': [
+                {'name': 'a', 'throughput': 1000, 'p99': 2.0},
+                {'name': 'b', 'throughput': 1000, 'p99': 2.0},
+                {'name': 'c', 'throughput': 1000, 'p99': 2.0},
+                ]}
+        results = {'scenarios': [
+                {'name': 'a', 'throughput': 900, 'p99': 2.2},
+                {'name': 'b', 'throughput': 700, 'p99': 2.0},
+                {'name': 'c', 'throughput': 1000, 'p99': 3.0},
+                {'name': 'd', 'throughput': 1, 'p99': 100.0},
+                ]}
+        self.assertEqual(benchmark.compare(results, baseline, 0.2), [
+                ('b', 'throughput', 1000, 700),
+                ('c', 'p99', 2.0, 3.0),
+                ])
+
+    def test_0030_scenarios(self):
+        """Test that the scenarios cover the parameters"""
+        scenarios = list(benchmark.scenarios(types=['postgres_seq'],
+                concurrency=[1, 64]))
+        self.assertEqual(len(scenarios), 16)
+        self.assertEqual(len(set(s['name'] for s in scenarios)), 16)
+
+
+def suite():
+    "Sequence Postgres test suite"
+    suite = trytond.tests.test_tryton.suite()
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestSequencePostgres
+        )
+    )
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestSnowflake
+        )
+    )
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestSharedPool
+        )
+    )
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestStatistics
+        )
+    )
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestContention
+        )
+    )
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(
+        TestBenchmark
         )
     )
     return suite